@@ -0,0 +1,292 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import sys
+import json
+import hashlib
+import tempfile
+import numpy as np
+from collections import OrderedDict
+from . import __version__
+from .textmodel import NormalizedText
+from .utils import KLASS
+
+
+class CorpusCache(object):
+    """
+    Disk cache of preprocessed corpora. It stores the normalized texts
+    (:py:func:`microtc.textmodel.TextModel.text_transformations`).
+    An entry is identified by the hash of the texts of the corpus, the preprocessing
+    parameters of the model (:py:func:`microtc.textmodel.TextModel.preprocessing_params`),
+    the version of microtc, and the emoticons' table; the entries least recently used
+    are removed when the cache exceeds `max_size` bytes.
+
+    :param path: Directory of the cache, it defaults to $MICROTC_CACHE or ~/.cache/microtc
+    :type path: str
+    :param max_size: Maximum size (bytes) of the cache
+    :type max_size: int
+
+    Usage:
+
+    >>> import tempfile
+    >>> from microtc.cache import CorpusCache
+    >>> from microtc.textmodel import TextModel
+    >>> cache = CorpusCache(tempfile.mkdtemp())
+    >>> tm = TextModel()
+    >>> corpus = ['Buenos días @mario', 'Buenas noches']
+    >>> cache.normalize(corpus, tm)
+    ['~buenos~dias~_usr~', '~buenas~noches~']
+    >>> X = tm.fit_transform(cache.normalize(corpus, tm))
+    """
+
+    def __init__(self, path=None, max_size=1 << 30):
+        if path is None:
+            path = os.environ.get('MICROTC_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'microtc'))
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.max_size = max_size
+
+    @staticmethod
+    def digest(corpus, text='text'):
+        """Hash of the texts of the corpus
+
+        :param corpus: Corpus
+        :type corpus: list
+        :param text: Key of the text when the elements are dictionaries
+        :type text: str
+        :rtype: str
+        """
+
+        h = hashlib.sha1()
+        for x in corpus:
+            if isinstance(x, dict):
+                x = x[text]
+            h.update(str(x).encode('utf-8'))
+            h.update(b'\x00')
+        return h.hexdigest()
+
+    def key(self, digest, textmodel):
+        """Name of the entry
+
+        :param digest: Hash of the corpus (see :py:func:`CorpusCache.digest`)
+        :type digest: str
+        :param textmodel: Text model
+        :type textmodel: microtc.textmodel.TextModel
+        :rtype: str
+        """
+
+        params = textmodel.preprocessing_params()
+        # the normalization changes with the version and the emoticons' table
+        params['version'] = __version__
+        emo = getattr(textmodel, 'emo_map', None)
+        params['emoticons'] = None if emo is None else emo.digest
+        params = json.dumps(params, sort_keys=True)
+        return hashlib.sha1((digest + params).encode('utf-8')).hexdigest()
+
+    def normalize(self, corpus, textmodel, digest=None):
+        """Corpus whose texts are normalized, i.e., :py:class:`microtc.textmodel.NormalizedText`
+        (see :py:func:`documents`)
+
+        :param corpus: Corpus
+        :type corpus: list
+        :param textmodel: Text model
+        :type textmodel: microtc.textmodel.TextModel
+        :param digest: Hash of the corpus, it is computed when it is None
+        :type digest: str
+        :rtype: list
+        """
+
+        texts = self.normalized_texts(corpus, textmodel, digest=digest)
+        return documents(corpus, texts, text=textmodel._text)
+
+    def normalized_texts(self, corpus, textmodel, digest=None):
+        """Normalized texts of the corpus
+
+        :param corpus: Corpus
+        :type corpus: list
+        :param textmodel: Text model
+        :type textmodel: microtc.textmodel.TextModel
+        :param digest: Hash of the corpus, it is computed when it is None
+        :type digest: str
+        :rtype: list
+        """
+
+        if digest is None:
+            digest = self.digest(corpus, text=textmodel._text)
+        key = self.key(digest, textmodel)
+        data = self.load(key)
+        if data is None:
+            texts = [textmodel.text_transformations(x) for x in corpus]
+            data = [x.encode('utf-8') for x in texts]
+            offsets = np.zeros(len(data) + 1, dtype=np.int64)
+            np.cumsum([len(x) for x in data], out=offsets[1:])
+            self.save(key, text=np.frombuffer(b''.join(data), dtype=np.uint8), offsets=offsets)
+            return [NormalizedText(x) for x in texts]
+        data, offsets = data['text'].tobytes(), data['offsets']
+        return [NormalizedText(data[s:e].decode('utf-8')) for s, e in zip(offsets[:-1], offsets[1:])]
+
+    def filename(self, key):
+        return os.path.join(self.path, key + '.npz')
+
+    def load(self, key):
+        """Arrays of the entry, None when it is not in the cache
+
+        :param key: Entry
+        :type key: str
+        :rtype: dict
+        """
+
+        fname = self.filename(key)
+        try:
+            with np.load(fname) as data:
+                output = {k: data[k] for k in data.files}
+        except (OSError, ValueError):
+            return None
+        # the modification time orders the entries by their last use
+        os.utime(fname)
+        return output
+
+    def save(self, key, **arrays):
+        """Stores the arrays of the entry and removes the entries least recently used
+
+        :param key: Entry
+        :type key: str
+        """
+
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fpt:
+            np.savez(fpt, **arrays)
+        # readers never see a partial entry
+        os.replace(tmp, self.filename(key))
+        self.evict()
+
+    def evict(self):
+        """Removes the entries least recently used until the cache fits in `max_size` bytes"""
+
+        entries = []
+        for fname in os.listdir(self.path):
+            if not fname.endswith('.npz'):
+                continue
+            fname = os.path.join(self.path, fname)
+            try:
+                st = os.stat(fname)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, fname))
+        entries.sort()
+        size = sum([x[1] for x in entries])
+        for _, s, fname in entries:
+            if size <= self.max_size:
+                break
+            try:
+                os.unlink(fname)
+            except OSError:
+                pass
+            size -= s
+
+
+def documents(corpus, texts, text='text'):
+    """Corpus with the normalized texts; each dictionary is replaced by one with only
+    the text and the label (the keys read by the score wrappers)
+
+    :param corpus: Corpus
+    :type corpus: list
+    :param texts: Normalized texts
+    :type texts: list
+    :param text: Key of the text
+    :type text: str
+    :rtype: list
+
+    >>> from microtc.cache import documents
+    >>> documents([{'text': 'Hola', 'klass': 'POS', 'id': 1}], ['~hola~'])
+    [{'text': '~hola~', 'klass': 'POS'}]
+    """
+
+    output = []
+    for x, t in zip(corpus, texts):
+        if isinstance(x, dict):
+            t = {text: t, KLASS: x[KLASS]} if KLASS in x else {text: t}
+        output.append(t)
+    return output
+
+
+class PreprocessingMemo(object):
+    """
+    Normalized texts kept in memory, one list per corpus and preprocessing parameters
+    (:py:func:`microtc.textmodel.TextModel.preprocessing_params`); the configurations
+    differing only in the tokenizers or the weighting reuse them. The lists least
+    recently used are removed when they use more than `max_size` bytes.
+
+    :param max_size: Maximum size (bytes) of the normalized texts
+    :type max_size: int
+
+    >>> from microtc.cache import PreprocessingMemo
+    >>> from microtc.textmodel import TextModel
+    >>> memo = PreprocessingMemo()
+    >>> corpus = ['Buenos días @mario', 'Buenas noches']
+    >>> a = memo.normalize(corpus, TextModel(token_list=[-1]))
+    >>> b = memo.normalize(corpus, TextModel(token_list=[3, 4]))
+    >>> a == b, len(memo)
+    (True, 1)
+    """
+
+    def __init__(self, max_size=1 << 28):
+        self.max_size = max_size
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def nbytes(self):
+        """Size (bytes) of the normalized texts"""
+
+        return sum([x[1] for x in self._data.values()])
+
+    def clear(self):
+        self._data.clear()
+
+    def normalize(self, corpus, textmodel, digest=None, cache=None):
+        """Corpus whose texts are normalized (see :py:func:`CorpusCache.normalize`)
+
+        :param corpus: Corpus
+        :type corpus: list
+        :param textmodel: Text model
+        :type textmodel: microtc.textmodel.TextModel
+        :param digest: Hash of the corpus, it is computed when it is None
+        :type digest: str
+        :param cache: Disk cache used when the corpus is not in memory
+        :type cache: CorpusCache
+        :rtype: list
+        """
+
+        if digest is None:
+            digest = CorpusCache.digest(corpus, text=textmodel._text)
+        key = (digest, json.dumps(textmodel.preprocessing_params(), sort_keys=True))
+        try:
+            texts, _ = self._data[key]
+            self._data.move_to_end(key)
+        except KeyError:
+            if cache is not None:
+                texts = cache.normalized_texts(corpus, textmodel, digest=digest)
+            else:
+                texts = [NormalizedText(textmodel.text_transformations(x)) for x in corpus]
+            self._data[key] = (texts, sys.getsizeof(texts) + sum([sys.getsizeof(x) for x in texts]))
+            size = self.nbytes
+            while size > self.max_size and len(self._data) > 1:
+                _, (_, nbytes) = self._data.popitem(last=False)
+                size -= nbytes
+        return documents(corpus, texts, text=textmodel._text)
+
+
+# normalized corpora shared by the evaluations of a process (see the score wrappers)
+MEMO = PreprocessingMemo()
@@ -16,9 +16,9 @@ import argparse
 import microtc
 import gzip
 from microtc.wrappers import ClassifierWrapper, RegressorWrapper
-from microtc.utils import read_data, read_data_labels, read_data_values, tweet_iterator
+from microtc.utils import read_corpus, tweet_iterator
 from multiprocessing import cpu_count, Pool
-from collections import defaultdict
+from collections import defaultdict, deque
 from .params import ParameterSelection
 from .scorewrapper import ScoreKFoldWrapper, ScoreSampleWrapper
 from .regscorewrapper import RegressionScoreKFoldWrapper, RegressionScoreSampleWrapper
@@ -29,7 +29,10 @@ from sklearn.model_selection import KFold
 import numpy as np
 import os
 import json
+import sys
 from .utils import save_model, load_model
+from .cache import CorpusCache
+from .weighting import chunks
 
 
 def load_json(filename):
@@ -68,11 +71,117 @@ def balance(X, y):
     return X, y
 
 
+def read_values(filename):
+    return read_corpus(filename, get_label=VALUE, label_type=float)
+
+
 def clean_params(kw):
     params = TextModel.params()
     return {k: v for k, v in kw.items() if k in params}
 
 
+def predict_tweets(model, svc, le, tweets, ordinal=None):
+    """Adds the prediction to each tweet
+
+    :param model: Text model
+    :type model: microtc.textmodel.TextModel
+    :param svc: Classifier or regressor
+    :type svc: microtc.wrappers.ClassifierWrapper
+    :param le: Label encoder, None on regression
+    :type le: sklearn.preprocessing.LabelEncoder
+    :param tweets: Tweets
+    :type tweets: list
+    :param ordinal: Range start:end of the integer predictions on regression
+    :type ordinal: str
+    :rtype: list
+    """
+
+    veclist = model.transform(tweets)
+    if le is None:
+        hy = svc.predict(veclist)
+
+        if ordinal:
+            start, end = ordinal.split(':')
+            start = int(start)
+            end = int(end)
+
+            for tweet, pred in zip(tweets, hy):
+                c = round(pred)
+                if c < start:
+                    c = start
+                elif c > end:
+                    c = end
+
+                if c == 0:  # handles IEEE's negative cero -0.0
+                    c = 0
+
+                tweet[VALUE] = int(c)
+        else:
+            for tweet, pred in zip(tweets, hy):
+                tweet[VALUE] = pred
+        return tweets
+
+    decision_function = None
+    predict_proba = None
+    try:
+        decision_function = svc.decision_function(veclist).tolist()
+    except AttributeError:
+        try:
+            predict_proba = svc.predict_proba(veclist).tolist()
+        except AttributeError:
+            pass
+
+    hyy = le.inverse_transform(svc.predict(veclist))
+
+    for i, tweet in enumerate(tweets):
+        if decision_function is not None:
+            tweet['decision_function'] = decision_function[i]
+        if predict_proba is not None:
+            tweet['predict_proba'] = predict_proba[i]
+
+        klass = hyy[i]
+        tweet[KLASS] = str(klass)
+        tweet['predicted'] = tweet[KLASS]
+    return tweets
+
+
+_PREDICT_MODEL = None
+
+
+def _predict_init(model_svc_le, ordinal):
+    global _PREDICT_MODEL
+    if isinstance(model_svc_le, str):
+        # each process maps the model file once
+        model_svc_le = load_model(model_svc_le)
+    _PREDICT_MODEL = list(model_svc_le) + [ordinal]
+
+
+def _predict_chunk(tweets):
+    return predict_tweets(*_PREDICT_MODEL[:3], tweets, ordinal=_PREDICT_MODEL[3])
+
+
+def ordered_imap(pool, func, iterable, window):
+    """Like `pool.imap` but it reads the iterable as the results are consumed, keeping
+    at most `window` pending tasks; the results are in the order of the iterable
+
+    :param pool: Pool of processes
+    :type pool: multiprocessing.Pool
+    :param func: Function
+    :param iterable: Arguments
+    :param window: Maximum number of pending tasks
+    :type window: int
+    :rtype: generator
+    """
+
+    pending = deque()
+    for arg in iterable:
+        pending.append(pool.apply_async(func, (arg, )))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while len(pending):
+        yield pending.popleft().get()
+
+
 class CommandLine(object):
     def __init__(self):
         self.parser = argparse.ArgumentParser(description='microtc')
@@ -118,6 +227,14 @@ class CommandLine(object):
                RegressionScoreSampleWrapper.valid_scores
            ))
         pa('--conf', dest='conf', type=str, default=None, help="Do not perform search, just evaluate the given configuration (in json-format)")
+        self.param_cache()
+
+    def param_cache(self):
+        pa = self.parser.add_argument
+        pa('--cache', dest='cache', type=str, default=None,
+           help="Directory of the cache of the preprocessed corpora (see microtc.cache.CorpusCache)")
+        pa('--cache-size', dest='cache_size', type=int, default=1024,
+           help="Maximum size (MB) of the cache; the entries least recently used are removed")
 
     def param_set(self):
         pa = self.parser.add_argument
@@ -130,6 +247,11 @@ class CommandLine(object):
             return self.data.training_set[0] + ".output"
         return self.data.output
 
+    def get_cache(self):
+        if getattr(self.data, 'cache', None) is None:
+            return None
+        return CorpusCache(self.data.cache, max_size=self.data.cache_size << 20)
+
     def main(self, args=None, params=None):
         self.data = self.parser.parse_args(args=args)
         np.random.seed(self.data.seed)
@@ -144,11 +266,11 @@ class CommandLine(object):
         if self.data.score in RegressionScoreSampleWrapper.valid_scores:
             ScoreSample = RegressionScoreSampleWrapper
             ScoreKFold = RegressionScoreKFoldWrapper
-            _read_data = read_data_values
+            _read_data = read_values
         else:
             ScoreSample = ScoreSampleWrapper
             ScoreKFold = ScoreKFoldWrapper
-            _read_data = read_data_labels
+            _read_data = read_corpus
 
         sel = ParameterSelection(params=params)
         X, y = [], []
@@ -156,27 +278,28 @@ class CommandLine(object):
         for train in self.data.training_set:
             if train.startswith("static:"):
                 X_, y_ = _read_data(train[7:])
-                Xstatic.extend([x for x in tweet_iterator(train[7:])])
+                Xstatic.extend(X_)
                 ystatic.extend(y_)
             else:
                 X_, y_ = _read_data(train)
-                X.extend([x for x in tweet_iterator(train)])
+                X.extend(X_)
                 y.extend(y_)
 
         if self.data.balanced:
             X, y = balance(X, y)
 
+        cache = self.get_cache()
         if ":" in self.data.kratio:
             ratio, test_ratio = self.data.kratio.split(":")
-            fun_score = ScoreSample(X, y, Xstatic=Xstatic, ystatic=ystatic, ratio=float(ratio), test_ratio=float(test_ratio), score=self.data.score, random_state=self.data.seed)
+            fun_score = ScoreSample(X, y, Xstatic=Xstatic, ystatic=ystatic, ratio=float(ratio), test_ratio=float(test_ratio), score=self.data.score, random_state=self.data.seed, cache=cache)
         else:
             ratio = float(self.data.kratio)
             if ratio == 1.0:
                 raise ValueError('k=1 is undefined')
             if ratio > 1:
-                fun_score = ScoreKFold(X, y, Xstatic=Xstatic, ystatic=ystatic, nfolds=int(ratio), score=self.data.score, random_state=self.data.seed)
+                fun_score = ScoreKFold(X, y, Xstatic=Xstatic, ystatic=ystatic, nfolds=int(ratio), score=self.data.score, random_state=self.data.seed, cache=cache)
             else:
-                fun_score = ScoreSample(X, y, Xstatic=Xstatic, ystatic=ystatic, ratio=ratio, score=self.data.score, random_state=self.data.seed)
+                fun_score = ScoreSample(X, y, Xstatic=Xstatic, ystatic=ystatic, ratio=ratio, score=self.data.score, random_state=self.data.seed, cache=cache)
 
         if self.data.best_list:
             best_list = load_json(self.data.best_list)
@@ -228,6 +351,7 @@ class CommandLineTrain(CommandLine):
            help="Specifies the configuration in JSON-format")
         pa('-R', '--regression', dest='regression', action='store_true',
            help="The model will be a regressor")
+        self.param_cache()
 
     def main(self, args=None):
         self.data = self.parser.parse_args(args=args)
@@ -237,22 +361,24 @@ class CommandLineTrain(CommandLine):
             best = load_json(self.data.params_fname)[self.data.position]
         best = clean_params(best)
         if self.data.regression:
-            _read_data = read_data_values
+            _read_data = read_values
             wrapper = RegressorWrapper
         else:
-            _read_data = read_data_labels
+            _read_data = read_corpus
             wrapper = ClassifierWrapper
 
         corpus, values = [], []
         for train in self.data.training_set:
             X_, y_ = _read_data(train)
-            corpus.extend([x for x in tweet_iterator(train)])
+            corpus.extend(X_)
             values.extend(y_)
 
         if self.data.balanced:
             corpus, values = balance(corpus, values)
 
-        t = TextModel(corpus, **best)
+        t = TextModel(**best)
+        cache = self.get_cache()
+        X = t.fit_transform(corpus if cache is None else cache.normalize(corpus, t))
         if self.data.regression:
             le = None
             y = values
@@ -266,7 +392,6 @@ class CommandLineTrain(CommandLine):
             y = le.transform(values)
 
         c = wrapper()
-        X = [t[x] for x in corpus]
         c.fit(X, y)
         save_model([t, c, le], self.get_output())
         return [t, c, le]
@@ -288,7 +413,9 @@ class CommandLinePredict(CommandLine):
 
     def get_output(self):
         if self.data.output is None:
-            return self.data.test_set[0] + ".predicted"
+            if self.data.test_set == '-':
+                return '-'
+            return self.data.test_set + ".predicted"
 
         return self.data.output
 
@@ -297,74 +424,43 @@ class CommandLinePredict(CommandLine):
         pa = self.parser.add_argument
         pa('test_set',
            default=None,
-           help=cdn)
+           help=cdn + " ('-' reads the standard input)")
+        pa('-b', '--batch-size', dest='batch_size', type=int, default=1024,
+           help="Number of tweets read, predicted, and written together")
+        pa('-n', '--numprocs', dest='numprocs', type=int, default=1,
+           help="Number of processes predicting the batches (0 uses all the cores)")
         pa('--ordinal', dest='ordinal', default=None,
            help="rounds a regression prediction to the nearest integer among the given start:end range")
 
-    def main(self, args=None, model_svc_le=None):
+    def main(self, args=None, model_svc_le=None, keep=True):
         self.data = self.parser.parse_args(args=args)
         if model_svc_le is None:
-            model, svc, le = load_model(self.data.model)
-        else:
-            model, svc, le = model_svc_le
-
-        veclist = []
-        for x in read_data(self.data.test_set):
-            v = model[x]
-            veclist.append(v)
+            model_svc_le = self.data.model if self.data.numprocs != 1 else load_model(self.data.model)
 
         L = []
-        if le is None:
-            hy = svc.predict(veclist)
-
-            if self.data.ordinal:
-                start, end = self.data.ordinal.split(':')
-                start = int(start)
-                end = int(end)
-
-                for tweet, pred in zip(tweet_iterator(self.data.test_set), hy):
-                    c = round(pred)
-                    if c < start:
-                        c = start
-                    elif c > end:
-                        c = end
-
-                    if c == 0:  # handles IEEE's negative cero -0.0
-                        c = 0
-
-                    tweet[VALUE] = int(c)
-                    L.append(tweet)
+        output = self.get_output()
+        batches = chunks(tweet_iterator(self.data.test_set), self.data.batch_size)
+        pool = None
+        fpt = sys.stdout if output == '-' else open(output, 'w')
+        try:
+            if self.data.numprocs == 1:
+                model, svc, le = model_svc_le
+                predicted = (predict_tweets(model, svc, le, tweets, self.data.ordinal) for tweets in batches)
             else:
-                for tweet, pred in zip(tweet_iterator(self.data.test_set), hy):
-                    tweet[VALUE] = pred
-                    L.append(tweet)
-        else:
-            decision_function = None
-            predict_proba = None
-            try:
-                decision_function = svc.decision_function(veclist).tolist()
-            except AttributeError:
-                try:
-                    predict_proba = svc.predict_proba(veclist).tolist()
-                except AttributeError:
-                    pass
-
-            hyy = le.inverse_transform(svc.predict(veclist))
-
-            for i, tweet in enumerate(tweet_iterator(self.data.test_set)):
-                if decision_function is not None:
-                    tweet['decision_function'] = decision_function[i]
-                if predict_proba is not None:
-                    tweet['predict_proba'] = predict_proba[i]
-
-                klass = hyy[i]
-                tweet[KLASS] = str(klass)
-                tweet['predicted'] = tweet[KLASS]
-                L.append(tweet)
-
-        with open(self.get_output(), 'w') as fpt:
-            for tweet in L:
-                fpt.write(json.dumps(tweet)+"\n")
+                numprocs = self.data.numprocs if self.data.numprocs > 0 else cpu_count()
+                pool = Pool(numprocs, initializer=_predict_init, initargs=(model_svc_le, self.data.ordinal))
+                predicted = ordered_imap(pool, _predict_chunk, batches, 2 * numprocs)
+            for tweets in predicted:
+                fpt.write("".join([json.dumps(tweet) + "\n" for tweet in tweets]))
+                fpt.flush()
+                if keep:
+                    L.extend(tweets)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            if fpt is not sys.stdout:
+                fpt.close()
 
         return L
 
@@ -393,6 +489,8 @@ class CommandLineRetrain(CommandLinePredict):
            help='save the modified model to the given output file')
         pa('training_set', default=None, nargs='+', help="The trainset, it can be used to retrain a model or readjust the model")
         pa('-R', '--regression', dest='regression', action='store_true', help="The model will be a regressor")
+        pa('-u', '--update-textmodel', dest='update_textmodel', default=False, action='store_true',
+           help="Extends the text model with the tokens and frequencies of the training set")
 
     def main(self, args=None):
         self.data = self.parser.parse_args(args=args)
@@ -400,10 +498,10 @@ class CommandLineRetrain(CommandLinePredict):
         textmodel, svc, le = load_model(self.data.model)
 
         if self.data.regression:
-            _read_data = read_data_values
+            _read_data = read_values
             wrapper = RegressorWrapper
         else:
-            _read_data = read_data_labels
+            _read_data = read_corpus
             wrapper = ClassifierWrapper
 
         corpus, values = [], []
@@ -418,13 +516,53 @@ class CommandLineRetrain(CommandLinePredict):
         else:
             y = le.transform(values)
 
+        if self.data.update_textmodel:
+            textmodel.partial_fit(corpus)
         c = wrapper()
-        X = [textmodel[x] for x in corpus]
+        X = textmodel.transform(corpus)
         c.fit(X, y)
         save_model([textmodel, c, le], self.get_output())
         return [textmodel, c, le]
 
 
+class CommandLineServe(CommandLine):
+    def __init__(self):
+        self.parser = argparse.ArgumentParser(description='microtc')
+        pa = self.parser.add_argument
+        pa('-m', '--model', dest='model', type=str, required=True,
+           help="SVM Model file name")
+        pa('--host', dest='host', type=str, default='127.0.0.1', help="Host")
+        pa('-p', '--port', dest='port', type=int, default=8000, help="Port")
+        pa('-u', '--unix-socket', dest='unix_socket', type=str, default=None,
+           help="Listen on the given Unix socket instead of a port")
+        pa('-b', '--batch-size', dest='batch_size', type=int, default=64,
+           help="Maximum number of texts vectorized and predicted together")
+        pa('-d', '--max-delay', dest='max_delay', type=float, default=5,
+           help="Maximum time (milliseconds) a request waits for others to complete a batch")
+        pa('-v', '--verbose', dest='verbose', default=False, action='store_true',
+           help="Log the requests")
+        self.version()
+
+    def main(self, args=None, run=True):
+        from .server import MicroBatcher, make_server
+        self.data = self.parser.parse_args(args=args)
+        textmodel, svc, le = load_model(self.data.model)
+        batcher = MicroBatcher(textmodel, svc, le, batch_size=self.data.batch_size,
+                               max_delay=self.data.max_delay / 1000.0)
+        server = make_server(batcher, host=self.data.host, port=self.data.port,
+                             unix_socket=self.data.unix_socket, verbose=self.data.verbose)
+        if not run:
+            return server
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            batcher.close()
+        return server
+
+
 class CommandLineKfolds(CommandLineTrain):
     def __init__(self):
         super(CommandLineKfolds, self).__init__()
@@ -449,8 +587,8 @@ class CommandLineKfolds(CommandLineTrain):
         best = clean_params(best)
         corpus, labels = [], []
         for train in self.data.training_set:
-            X_, y_ = read_data_labels(train)
-            corpus.extend([x for x in tweet_iterator(train)])
+            X_, y_ = read_corpus(train)
+            corpus.extend(X_)
             labels.extend(y_)
         le = LabelEncoder()
         if self.data.labels:
@@ -470,25 +608,24 @@ class CommandLineKfolds(CommandLineTrain):
                     labels_.append(y[i])
 
             t = TextModel(docs_, **best)
+            X = t.transform(corpus)
         else:
-            t = TextModel(corpus, **best)
+            t = TextModel(**best)
+            cache = self.get_cache()
+            X = t.fit_transform(corpus if cache is None else cache.normalize(corpus, t))
 
-        X = [t[x] for x in corpus]
         hy = [None for x in y]
         for tr, ts in KFold(n_splits=self.data.kratio,
                             shuffle=True, random_state=self.data.seed).split(X):
             c = ClassifierWrapper()
-            c.fit([X[x] for x in tr], [y[x] for x in tr])
-            _ = c.decision_function([X[x] for x in ts])
+            c.fit(X[tr], y[tr])
+            _ = c.decision_function(X[ts])
             [hy.__setitem__(k, v) for k, v in zip(ts, _)]
 
-        i = 0
         with open(self.get_output(), 'w') as fpt:
-            for train in self.data.training_set:
-                for tweet in tweet_iterator(train):
-                    tweet['decision_function'] = hy[i].tolist()
-                    i += 1
-                    fpt.write(json.dumps(tweet)+"\n")
+            for tweet, df in zip(corpus, hy):
+                tweet['decision_function'] = df.tolist()
+                fpt.write(json.dumps(tweet)+"\n")
         return hy
 
 
@@ -527,6 +664,13 @@ def textmodel(*args, **kwargs):
     return c.main(args, **kwargs)
 
 
+def serve(*args, **kwargs):
+    c = CommandLineServe()
+    if len(args) == 0:
+        args = None
+    return c.main(args, **kwargs)
+
+
 def kfolds(*args, **kwargs):
     c = CommandLineKfolds()
     if len(args) == 0:
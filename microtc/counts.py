@@ -0,0 +1,389 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import copy
+import json
+import hashlib
+import numpy as np
+from collections import Counter, OrderedDict
+from scipy.sparse import csr_matrix
+from .textmodel import SKIP_SYMBOLS_AND_SPACES, TextModel
+from .utils import get_class
+from .weighting import Vocabulary
+from .cache import CorpusCache, MEMO
+
+
+class CountBlock(object):
+    """
+    Number of times each token of an element `q` of the token list appears in each document;
+    the entries of a document follow the order in which its tokens appear.
+
+    :param corpus: Corpus
+    :type corpus: list
+    :param textmodel: Text model, its preprocessing is applied to the corpus
+    :type textmodel: microtc.textmodel.TextModel
+    :param q: Element of the token list
+    :type q: int or list
+
+    >>> from microtc.counts import CountBlock
+    >>> from microtc.textmodel import TextModel
+    >>> block = CountBlock(['buenos dias', 'dias dias'], TextModel(), -1)
+    >>> block.tokens, block.rows.tolist(), block.cols.tolist(), block.counts.tolist()
+    (['buenos', 'dias'], [0, 0, 1], [0, 1, 1], [1, 1, 2])
+    """
+
+    def __init__(self, corpus, textmodel, q):
+        tm = copy.copy(textmodel)
+        tm.token_list = [q]
+        w2id = dict()
+        rows, cols, counts = [], [], []
+        for r, text in enumerate(corpus):
+            tokens = Counter(tm.compute_tokens(tm.text_transformations(text))[0])
+            rows.extend([r] * len(tokens))
+            cols.extend([w2id.setdefault(x, len(w2id)) for x in tokens.keys()])
+            counts.extend(tokens.values())
+        self.ndocs = len(corpus)
+        self.tokens = list(w2id.keys())
+        self.rows = np.array(rows, dtype=np.int64)
+        self.cols = np.array(cols, dtype=np.int64)
+        self.counts = np.array(counts, dtype=np.int32)
+        # position of the token among the distinct tokens of the document
+        starts = np.zeros(self.ndocs + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.rows, minlength=self.ndocs), out=starts[1:])
+        self.ranks = np.arange(self.rows.shape[0]) - starts[self.rows]
+
+    @property
+    def nbytes(self):
+        return sum([x.nbytes for x in [self.rows, self.cols, self.counts, self.ranks]])
+
+
+class CountMatrix(object):
+    """
+    Document-term count matrix of a token list composed of the blocks of its elements;
+    the tokens shared by two blocks are a single term. The documents without tokens
+    contain the token '~' (see :py:func:`microtc.textmodel.TextModel.tokenize`).
+    The count matrices of the last `maxsize` sets of documents are kept, so the weighting
+    schemes evaluated on the same folds do not compute them again.
+
+    :param blocks: Blocks in the order of the token list
+    :type blocks: list
+    :param select_suff: Keep the tokens ending in a symbol or space
+    :type select_suff: bool
+    :param select_conn: Keep the tokens connecting words
+    :type select_conn: bool
+    :param maxsize: Maximum number of count matrices kept
+    :type maxsize: int
+
+    >>> from microtc.counts import CountBlock, CountMatrix
+    >>> from microtc.textmodel import TextModel
+    >>> tm = TextModel(token_list=[-1, 3])
+    >>> corpus = ['buenos dias', 'dias']
+    >>> matrix = CountMatrix([CountBlock(corpus, tm, q) for q in tm.token_list])
+    >>> counts, order = matrix.counts(np.array([1, 0]), order=True)
+    >>> [matrix.tokens[i] for i in order[:4]]
+    ['dias', '~di', 'dia', 'ias']
+    """
+
+    def __init__(self, blocks, select_suff=False, select_conn=False, maxsize=16):
+        w2id = dict()
+        rows, cols, counts, keys = [], [], [], []
+        ndocs = blocks[0].ndocs
+        for k, block in enumerate(blocks):
+            ident = np.array([w2id.setdefault(x, len(w2id)) for x in block.tokens], dtype=np.int64)
+            mask = np.ones(len(block.tokens), dtype=bool)
+            if select_suff:
+                mask &= [x[-1] in SKIP_SYMBOLS_AND_SPACES for x in block.tokens]
+            if select_conn:
+                mask &= ['~' in x and x[0] != '~' and x[-1] != '~' for x in block.tokens]
+            m = mask[block.cols] if not mask.all() else slice(None)
+            rows.append(block.rows[m])
+            cols.append(ident[block.cols[m]])
+            counts.append(block.counts[m])
+            # the tokens of a document are sorted by block and then by position
+            keys.append(block.ranks[m] + (k << 32))
+        rows = np.concatenate(rows)
+        empty = np.flatnonzero(np.bincount(rows, minlength=ndocs) == 0)
+        if empty.shape[0]:
+            rows = np.concatenate([rows, empty])
+            cols.append(np.full(empty.shape[0], w2id.setdefault('~', len(w2id)), dtype=np.int64))
+            counts.append(np.ones(empty.shape[0], dtype=np.int32))
+            keys.append(np.zeros(empty.shape[0], dtype=np.int64))
+        self.ndocs = ndocs
+        self.tokens = list(w2id.keys())
+        self.rows = rows
+        self.cols = np.concatenate(cols)
+        self._counts = np.concatenate(counts)
+        self.keys = np.concatenate(keys)
+        self.maxsize = maxsize
+        self._memo = OrderedDict()
+        self._vocabulary = None
+
+    @property
+    def num_terms(self):
+        return len(self.tokens)
+
+    @property
+    def vocabulary(self):
+        """Map from token to column, the vocabularies of the models are taken from it"""
+
+        if self._vocabulary is None:
+            self._vocabulary = Vocabulary({x: i for i, x in enumerate(self.tokens)})
+        return self._vocabulary
+
+    @property
+    def nbytes(self):
+        output = sum([x.nbytes for x in [self.rows, self.cols, self._counts, self.keys]])
+        for counts, order in self._memo.values():
+            output += counts.data.nbytes + counts.indices.nbytes + counts.indptr.nbytes
+            output += 0 if order is None else order.nbytes
+        return output
+
+    def counts(self, index, order=False):
+        """Count matrix of the documents `index`, the i-th row is the document index[i]
+
+        :param index: Documents
+        :type index: np.array
+        :param order: Compute the terms in the order they appear in the documents
+        :type order: bool
+        :rtype: csr_matrix or tuple - matrix and order of the terms
+        """
+
+        index = np.asarray(index, dtype=np.int64)
+        key = (hashlib.sha1(index.tobytes()).hexdigest(), order)
+        try:
+            counts, cols = self._memo[key]
+            self._memo.move_to_end(key)
+        except KeyError:
+            counts, cols = self._counts_index(index, order)
+            self._memo[key] = (counts, cols)
+            while len(self._memo) > self.maxsize:
+                self._memo.popitem(last=False)
+        return (counts, cols) if order else counts
+
+    def _counts_index(self, index, order):
+        pos = np.full(self.ndocs, -1, dtype=np.int64)
+        pos[index] = np.arange(len(index))
+        rows = pos[self.rows]
+        mask = rows >= 0
+        rows, cols = rows[mask], self.cols[mask]
+        counts = csr_matrix((self._counts[mask], (rows, cols)), shape=(len(index), self.num_terms))
+        counts.sum_duplicates()
+        if not order:
+            return counts, None
+        cols = cols[np.lexsort((self.keys[mask], rows))]
+        _, first = np.unique(cols, return_index=True)
+        return counts, cols[np.sort(first)]
+
+    def fit_transform(self, textmodel, corpus, train, test):
+        """Vectors of the documents `train` and `test` where the weighting scheme of the text
+        model is trained with `train`; they are the vectors computed by
+        :py:func:`microtc.textmodel.TextModel.fit_transform` and :py:func:`microtc.textmodel.TextModel.transform`
+
+        :param textmodel: Text model
+        :type textmodel: microtc.textmodel.TextModel
+        :param corpus: Corpus
+        :type corpus: list
+        :param train: Training documents
+        :type train: np.array
+        :param test: Test documents
+        :type test: np.array
+        :rtype: tuple
+        """
+
+        counts, order = self.counts(train, order=True)
+        klass = get_class(textmodel.weighting)
+        model, columns = klass.from_counts(counts, self.vocabulary, order, X=[corpus[i] for i in train],
+                                           token_min_filter=textmodel.token_min_filter,
+                                           token_max_filter=textmodel.token_max_filter)
+        textmodel.model = model
+        textmodel._num_terms = model.num_terms
+        trainX = model.transform_counts(counts[:, columns])
+        return trainX, model.transform_counts(self.counts(test)[:, columns])
+
+
+def supports_counts(textmodel):
+    """The text model can be trained with a :py:class:`CountMatrix`
+
+    :param textmodel: Text model
+    :type textmodel: microtc.textmodel.TextModel
+    :rtype: bool
+    """
+
+    if getattr(textmodel, 'hash_size', None) or getattr(textmodel, 'max_terms', None):
+        return False
+    return hasattr(get_class(textmodel.weighting), 'from_counts')
+
+
+class CountBlocks(object):
+    """
+    Blocks (see :py:class:`CountBlock`) kept in memory, one per corpus, preprocessing
+    parameters, and element of the token list; the token lists sharing elements reuse them.
+    The last `max_matrices` count matrices are also kept, so the configurations differing
+    only in the weighting scheme or the token filters reuse the matrix of their token list.
+    When the blocks and the matrices, including the counts memoized by the matrices, use
+    more than `max_size` bytes, the matrices least recently used are removed and then the blocks.
+
+    :param max_size: Maximum size (bytes) of the blocks and the matrices
+    :type max_size: int
+    :param max_matrices: Maximum number of count matrices
+    :type max_matrices: int
+
+    >>> from microtc.counts import CountBlocks
+    >>> from microtc.textmodel import TextModel
+    >>> blocks = CountBlocks()
+    >>> corpus = ['buenos dias', 'buenas noches']
+    >>> matrix = blocks.matrix(corpus, TextModel(token_list=[-1, 3]))
+    >>> matrix = blocks.matrix(corpus, TextModel(token_list=[3, 4]))
+    >>> len(blocks)
+    3
+    >>> blocks.matrix(corpus, TextModel(token_list=[3, 4], weighting='entropy')) is matrix
+    True
+    """
+
+    def __init__(self, max_size=1 << 30, max_matrices=4):
+        self.max_size = max_size
+        self.max_matrices = max_matrices
+        self._data = OrderedDict()
+        self._matrices = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def nbytes(self):
+        """Size (bytes) of the blocks and the matrices"""
+
+        return sum([x.nbytes for x in self._data.values()]) + sum([x.nbytes for x in self._matrices.values()])
+
+    def clear(self):
+        self._data.clear()
+        self._matrices.clear()
+
+    def evict(self):
+        """Removes the matrices and then the blocks least recently used until they fit
+        in `max_size` bytes; the last matrix and the last block are kept"""
+
+        size = self.nbytes
+        while size > self.max_size and len(self._matrices) > 1:
+            _, matrix = self._matrices.popitem(last=False)
+            size -= matrix.nbytes
+        while size > self.max_size and len(self._data) > 1:
+            _, block = self._data.popitem(last=False)
+            size -= block.nbytes
+
+    def block(self, corpus, textmodel, q, digest):
+        key = (digest, json.dumps(textmodel.preprocessing_params(), sort_keys=True), json.dumps(q))
+        try:
+            output = self._data[key]
+            self._data.move_to_end(key)
+            return output
+        except KeyError:
+            pass
+        output = CountBlock(corpus, textmodel, q)
+        self._data[key] = output
+        self.evict()
+        return output
+
+    def matrix(self, corpus, textmodel, digest=None):
+        """Count matrix of the token list of the text model
+
+        :param corpus: Corpus
+        :type corpus: list
+        :param textmodel: Text model
+        :type textmodel: microtc.textmodel.TextModel
+        :param digest: Hash of the corpus (see :py:func:`microtc.cache.CorpusCache.digest`)
+        :type digest: str
+        :rtype: CountMatrix
+        """
+
+        if digest is None:
+            digest = CorpusCache.digest(corpus, text=textmodel._text)
+        key = (digest, json.dumps(textmodel.preprocessing_params(), sort_keys=True),
+               json.dumps(textmodel.token_list), textmodel.select_suff, textmodel.select_conn)
+        try:
+            output = self._matrices[key]
+            self._matrices.move_to_end(key)
+        except KeyError:
+            blocks = [self.block(corpus, textmodel, q, digest) for q in textmodel.token_list]
+            output = CountMatrix(blocks, select_suff=textmodel.select_suff, select_conn=textmodel.select_conn)
+            self._matrices[key] = output
+            while len(self._matrices) > self.max_matrices:
+                self._matrices.popitem(last=False)
+        # the matrices grow with the counts they memoize after being returned
+        self.evict()
+        return output
+
+
+# blocks shared by the evaluations of a process (see the score wrappers)
+BLOCKS = CountBlocks()
+
+
+class CorpusVectors(object):
+    """
+    Normalization and vectors of the corpora of the score wrappers (see
+    :py:mod:`microtc.scorewrapper` and :py:mod:`microtc.regscorewrapper`); the
+    normalized corpora are kept in :py:data:`microtc.cache.MEMO` and the count
+    matrices in :py:data:`BLOCKS`, so they are shared by the configurations
+    evaluated in the process. The wrapper may set `cache` to a
+    :py:class:`microtc.cache.CorpusCache`.
+    """
+
+    def normalize(self, name, corpus, conf):
+        """Corpus normalized with the preprocessing of `conf`; it is kept in memory for the
+        next configurations sharing the preprocessing (see :py:class:`microtc.cache.PreprocessingMemo`)
+        and read from the disk cache when it is available (see :py:class:`microtc.cache.CorpusCache`)
+
+        :param name: Name of the corpus, e.g., X
+        :type name: str
+        :param corpus: Corpus
+        :type corpus: list
+        :param conf: Parameters of the text model
+        :type conf: dict
+        :rtype: list
+        """
+
+        if len(corpus) == 0:
+            return corpus
+        textmodel = TextModel(**conf)
+        return MEMO.normalize(corpus, textmodel, digest=self.digest(name, corpus, textmodel),
+                              cache=getattr(self, 'cache', None))
+
+    def vectors(self, name, corpus, train, test, conf):
+        """Vectors of the documents `train` and `test` of the normalized corpus where the text model
+        is trained with `train`. The count matrix of the token list is composed of the blocks kept
+        in memory (see :py:class:`CountBlocks`) when the weighting scheme allows it.
+
+        :param name: Name of the corpus (see :py:func:`normalize`)
+        :type name: str
+        :param corpus: Normalized corpus
+        :type corpus: list
+        :param train: Training documents
+        :type train: np.array
+        :param test: Test documents
+        :type test: np.array
+        :param conf: Parameters of the text model
+        :type conf: dict
+        :rtype: tuple
+        """
+
+        textmodel = TextModel(**conf)
+        if supports_counts(textmodel):
+            matrix = BLOCKS.matrix(corpus, textmodel, digest=self.digest(name, corpus, textmodel))
+            return matrix.fit_transform(textmodel, corpus, train, test)
+        trainX = textmodel.fit_transform([corpus[i] for i in train])
+        return trainX, textmodel.transform([corpus[i] for i in test])
+
+    def digest(self, name, corpus, textmodel):
+        digests = self.__dict__.setdefault('_digests', dict())
+        key = (name, textmodel._text)
+        if key not in digests:
+            digests[key] = CorpusCache.digest(corpus, text=textmodel._text)
+        return digests[key]
@@ -1,8 +1,8 @@
 import json
+import hashlib
 import re
 import os
 
-from collections import defaultdict
 from .params import OPTION_DELETE, OPTION_GROUP, OPTION_NONE
 
 
@@ -37,62 +37,112 @@ from .params import OPTION_DELETE, OPTION_GROUP, OPTION_NONE
 #     return re.sub(r"\s+", " ", text).strip()
 
 
+EMOTICON_CLASSIFIERS = {}
+
+
+def get_emoticon_classifier(fname=None):
+    """Process-wide :py:class:`EmoticonClassifier`; the table is read and compiled once
+    per file and shared by every model
+
+    :param fname: emoticons' file (defaults to resources/emoticons.json)
+    :type fname: str
+    :rtype: EmoticonClassifier
+    """
+
+    try:
+        return EMOTICON_CLASSIFIERS[fname]
+    except KeyError:
+        emo = EmoticonClassifier(fname)
+        EMOTICON_CLASSIFIERS[fname] = emo
+        return emo
+
+
 class EmoticonClassifier:
+    """Replaces emoticons and emojis by their class. Alphabetic codes are matched as words
+    with a single regular expression and the rest with a trie in one scan of the text.
+
+    >>> from microtc.emoticons import get_emoticon_classifier
+    >>> emo = get_emoticon_classifier()
+    >>> emo.replace("hola :) xD adios")
+    'hola _pos _pos adios'
+    """
+
     def __init__(self, fname=None):
+        self.fname = fname
         if fname is None:
             fname = os.path.join(os.path.dirname(__file__), 'resources', 'emoticons.json')
 
-        self.emolen = defaultdict(dict)
-        self.emoreg = []
-        self.some = {}
-
-        with open(fname) as f:
-            X = json.load(f)
+        with open(fname, 'rb') as f:
+            data = f.read()
+        # identifies the table, e.g., in the keys of microtc.cache.CorpusCache
+        self.digest = hashlib.sha1(data).hexdigest()
+        X = json.loads(data.decode('utf-8'))
 
+        alpha = []
+        trie = {}
         for c, k in X.items():  # code, klass
             if c.isalpha():
-                r = re.compile(r"\b{0}\b".format(c), re.IGNORECASE)
-                self.emoreg.append((r, k))
-            else:
-                self.emolen[len(c)].setdefault(c, k)
-
-            self.some[c[0]] = max(len(c), self.some.get(c[0], 0))
-
-        maxlen = max(self.emolen.keys())
-        self.emolen = [self.emolen.get(i, {}) for i in range(maxlen+1)]
+                alpha.append((c, k))
+                continue
+
+            node = trie
+            for u in c:
+                node = node.setdefault(u, {})
+            # the key '' marks the end of a code
+            node.setdefault('', k)
+
+        # alphabetic codes are complete words, the first code (in the file's order) matching a word is used
+        first = "".join(sorted(set([re.escape(c[0]) for c, _ in alpha])))
+        self.emoreg = re.compile(r"\b(?=[{0}])(?:{1})\b".format(first, "|".join(["({0})".format(re.escape(c)) for c, _ in alpha])),
+                                 re.IGNORECASE)
+        self.emoreg_klass = tuple([k for _, k in alpha])
+        self.emotrie = trie
+
+    def __reduce__(self):
+        # pickles store a reference to the shared table instead of a copy
+        return (get_emoticon_classifier, (self.fname,))
+
+    def __setstate__(self, state):
+        # models pickled with a copy of the table
+        self.__dict__.update(get_emoticon_classifier(state.get('fname')).__dict__)
 
     def replace(self, text, option=OPTION_GROUP):
         if option == OPTION_NONE:
             return text
 
-        for pat, klass in self.emoreg:
-            if option == OPTION_DELETE:
-                klass = ''
- 
-            text = pat.sub(klass, text)
+        if option == OPTION_DELETE:
+            text = self.emoreg.sub('', text)
+        else:
+            klass = self.emoreg_klass
+            text = self.emoreg.sub(lambda m: klass[m.lastindex - 1], text)
 
+        # codes are searched on the lower cased text and the rest is copied from text;
+        # the shortest code starting at each position is used and it must be followed by
+        # at least one character
+        _text = text.lower()
+        n = len(_text)
+        size = len(text)
+        get = self.emotrie.get
         T = []
+        prev = 0
         i = 0
-        _text = text.lower()
-        while i < len(text):
-            replaced = False
-            if _text[i] in self.some:
-                for lcode in range(1, len(self.emolen)):
-                    if i + lcode < len(_text):
-                        code = _text[i:i+lcode]
-                        klass = self.emolen[lcode].get(code, None)
-
-                        if klass:
-                            if option == OPTION_DELETE:
-                                klass = ''
-
-                            T.append(klass)
-                            replaced = True
-                            i += lcode
-                            break
-            
-            if not replaced:
-                T.append(text[i])
-                i += 1
-
+        while i < size:
+            node = get(_text[i])
+            if node is not None:
+                j = i
+                while '' not in node:
+                    j += 1
+                    node = node.get(_text[j]) if j < n - 1 else None
+                    if node is None:
+                        break
+
+                if node is not None and j + 1 < n:
+                    T.append(text[prev:i])
+                    if option != OPTION_DELETE:
+                        T.append(node[''])
+                    i = prev = j + 1
+                    continue
+            i += 1
+
+        T.append(text[prev:])
         return "".join(T)
@@ -136,6 +136,13 @@ DefaultParams = dict(
     # token_max_filter=SetVariable([0.5, 0.9, 0.95, 0.99, 1.0]),
     # token_min_filter=SetVariable([-1, -2, -3, -5, -7, -9]),
     weighting=SetVariable(['tfidf', 'tf', 'entropy']),
+    # number of buckets of the feature hashing, None uses a vocabulary
+    hash_size=Fixed(None),
+    # hash_size=SetVariable([None, 2**16, 2**18, 2**20]),
+    # maximum number of terms, None keeps the whole vocabulary
+    max_terms=Fixed(None),
+    # width of the count-min sketch applied before token_min_filter, it does not change the model
+    sketch_width=Fixed(None),
 )
 
 if "PARAMS" in os.environ:
@@ -151,8 +158,13 @@ class ParameterSelection:
         if (params is None) or (0 == len(params)):
             params = DefaultParams
         else:
-            for k in DefaultParams.keys():
-                assert k in params, "{0} is not in given parameters; {1}".format(k, params)
+            params = dict(params)
+            for k, v in DefaultParams.items():
+                if k in params:
+                    continue
+                # the parameters that are not searched take their default value
+                assert isinstance(v, Fixed), "{0} is not in given parameters; {1}".format(k, params)
+                params[k] = Fixed(v.value)
 
         self.params = params
 
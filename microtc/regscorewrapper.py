@@ -20,15 +20,17 @@ from scipy.stats import pearsonr, spearmanr
 from sklearn import preprocessing
 from sklearn import model_selection
 from microtc.textmodel import TextModel
+from microtc.counts import CorpusVectors
 from microtc.wrappers import RegressorWrapper
 
 
-class RegressionScoreSampleWrapper(object):
+class RegressionScoreSampleWrapper(CorpusVectors):
     valid_scores = ['r2', 'pearsonr', 'spearmanr']
 
-    def __init__(self, X, y, Xstatic=[], ystatic=[], ratio=0.8, test_ratio=None, score='r2', classifier=RegressorWrapper, random_state=None):
+    def __init__(self, X, y, Xstatic=[], ystatic=[], ratio=0.8, test_ratio=None, score='r2', classifier=RegressorWrapper, random_state=None, cache=None):
         assert ratio < 1, "ratio {0} is invalid, valid values are 0 < ratio < 1".format(ratio)
         self.score = score
+        self.cache = cache
         self.le = preprocessing.LabelEncoder().fit(y)
         self.create_classifier = classifier
         if test_ratio is None:
@@ -55,8 +57,9 @@ class RegressionScoreSampleWrapper(object):
     def __call__(self, conf_code):
         conf, code = conf_code
         st = time()
-        textmodel = TextModel(self.train_corpus, **conf)
-        train_X = [textmodel[doc] for doc in self.train_corpus]
+        corpus = self.normalize('corpus', self.train_corpus + self.test_corpus, conf)
+        ntrain = len(self.train_corpus)
+        train_X, test_X = self.vectors('corpus', corpus, np.arange(ntrain), np.arange(ntrain, len(corpus)), conf)
         c = self.create_classifier()
         # c.fit(train_X, self.train_y)
         try:
@@ -66,7 +69,6 @@ class RegressionScoreSampleWrapper(object):
             conf["_score"] = 0.0
             return conf
     
-        test_X = [textmodel[doc] for doc in self.test_corpus]
         pred_y = c.predict(test_X)
         self.compute_score(conf, pred_y)
         conf['_time'] = (time() - st)
@@ -81,9 +83,10 @@ class RegressionScoreSampleWrapper(object):
 
 
 class RegressionScoreKFoldWrapper(RegressionScoreSampleWrapper):
-    def __init__(self, X, y, Xstatic=[], ystatic=[], nfolds=5, score='r2', classifier=RegressorWrapper, random_state=None):
+    def __init__(self, X, y, Xstatic=[], ystatic=[], nfolds=5, score='r2', classifier=RegressorWrapper, random_state=None, cache=None):
         self.nfolds = nfolds
         self.score = score
+        self.cache = cache
         # self.X = np.array(X)
         self.X = X
         self.Xstatic = Xstatic
@@ -102,18 +105,16 @@ class RegressionScoreKFoldWrapper(RegressionScoreSampleWrapper):
         st = time()
         predY = np.zeros(len(self.y))
         # X = np.array(self.X)
+        # the static examples follow X
+        corpus = self.normalize('corpus', list(self.X) + list(self.Xstatic), conf)
+        static = np.arange(len(self.X), len(corpus))
         for train, test in self.kfolds.split(self.X):
             # A = X[train]
-            A = [self.X[i] for i in train]
-            if len(self.Xstatic) > 0:
-                A.extend(self.Xstatic)
-
             trainY = self.y[train]
             if len(self.ystatic) > 0:
                 trainY = np.hstack((trainY, self.ystatic))
 
-            textmodel = TextModel(A, **conf)
-            trainX = [textmodel[x] for x in A]
+            trainX, testX = self.vectors('corpus', corpus, np.concatenate((train, static)), test, conf)
 
             c = self.create_classifier()
             try:
@@ -123,7 +124,6 @@ class RegressionScoreKFoldWrapper(RegressionScoreSampleWrapper):
                 conf["_score"] = 0.0
                 return conf
 
-            testX = [textmodel[self.X[i]] for i in test]
             predY[test] = c.predict(testX)
 
         self.compute_score(conf, predY)
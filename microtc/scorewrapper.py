@@ -20,15 +20,17 @@ from sklearn.metrics import f1_score, accuracy_score, recall_score, precision_sc
 from sklearn import preprocessing
 from sklearn import model_selection
 from microtc.textmodel import TextModel
+from microtc.counts import CorpusVectors
 from microtc.wrappers import ClassifierWrapper
 
 
-class ScoreSampleWrapper(object):
+class ScoreSampleWrapper(CorpusVectors):
     valid_scores = ['macrof1', 'macrorecall', 'macrof1accuracy', 'weightedf1', 'accuracy', 'avgf1', 'geometricf1', 'harmonicf1']
 
-    def __init__(self, X, y, Xstatic=[], ystatic=[], ratio=0.8, test_ratio=None, score='macrof1', classifier=ClassifierWrapper, random_state=None):
+    def __init__(self, X, y, Xstatic=[], ystatic=[], ratio=0.8, test_ratio=None, score='macrof1', classifier=ClassifierWrapper, random_state=None, cache=None):
         assert ratio < 1, "ratio {0} is invalid, valid values are 0 < ratio < 1".format(ratio)
         self.score = score
+        self.cache = cache
         self.le = preprocessing.LabelEncoder().fit(y)
         self.create_classifier = classifier
         if test_ratio is None:
@@ -58,17 +60,19 @@ class ScoreSampleWrapper(object):
         model_klass = os.environ.get("TEXTMODEL_KLASSES", None)
 
         if model_klass:
+            train_corpus = self.normalize('train_corpus', self.train_corpus, conf)
             model_klass = self.le.transform(model_klass.split(','))
-            _train = [self.train_corpus[i] for i in len(self.train_corpus) if self.train_y[i] in model_klass]
+            _train = [train_corpus[i] for i in range(len(train_corpus)) if self.train_y[i] in model_klass]
             textmodel = TextModel(_train, **conf)
-
+            train_X = textmodel.transform(train_corpus)
+            test_X = textmodel.transform(self.normalize('test_corpus', self.test_corpus, conf))
         else:
-            textmodel = TextModel(self.train_corpus, **conf)
+            corpus = self.normalize('corpus', self.train_corpus + self.test_corpus, conf)
+            ntrain = len(self.train_corpus)
+            train_X, test_X = self.vectors('corpus', corpus, np.arange(ntrain), np.arange(ntrain, len(corpus)), conf)
 
-        train_X = [textmodel[doc] for doc in self.train_corpus]
         c = self.create_classifier()
         c.fit(train_X, self.train_y)
-        test_X = [textmodel[doc] for doc in self.test_corpus]
         pred_y = c.predict(test_X)
         self.compute_score(conf, pred_y)
         conf['_time'] = (time() - st)
@@ -108,9 +112,10 @@ class ScoreSampleWrapper(object):
 
 
 class ScoreKFoldWrapper(ScoreSampleWrapper):
-    def __init__(self, X, y, Xstatic=[], ystatic=[], nfolds=5, score='macrof1', classifier=ClassifierWrapper, random_state=None):
+    def __init__(self, X, y, Xstatic=[], ystatic=[], nfolds=5, score='macrof1', classifier=ClassifierWrapper, random_state=None, cache=None):
         self.nfolds = nfolds
         self.score = score
+        self.cache = cache
         # self.X = np.array(X)
         self.X = X
         self.Xstatic = Xstatic
@@ -129,20 +134,16 @@ class ScoreKFoldWrapper(ScoreSampleWrapper):
         st = time()
         predY = np.zeros(len(self.y))
         # X = np.array(self.X)
+        # the static examples follow X
+        corpus = self.normalize('corpus', list(self.X) + list(self.Xstatic), conf)
+        static = np.arange(len(self.X), len(corpus))
         for train, test in self.kfolds.split(self.X, self.y):
             # A = X[train]
-            A = [self.X[i] for i in train]
-            if len(self.Xstatic) > 0:
-                A.extend(self.Xstatic)
-
             trainY = self.y[train]
             if len(self.ystatic) > 0:
                 trainY = np.hstack((trainY, self.ystatic))
 
-            textmodel = TextModel(A, **conf)
-            
-            # textmodel = TextModel([X[i] for i in train], **conf)
-            trainX = [textmodel[x] for x in A]
+            trainX, testX = self.vectors('corpus', corpus, np.concatenate((train, static)), test, conf)
 
             c = self.create_classifier()
             try:
@@ -152,7 +153,6 @@ class ScoreKFoldWrapper(ScoreSampleWrapper):
                 conf["_score"] = 0.0
                 return conf
 
-            testX = [textmodel[self.X[i]] for i in test]
             predY[test] = c.predict(testX)
 
         self.compute_score(conf, predY)
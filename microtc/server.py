@@ -0,0 +1,259 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import os
+import queue
+import socketserver
+import stat
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import time
+import numpy as np
+from .utils import KLASS, VALUE
+from .wrappers import decision_labels
+
+
+class MicroBatcher(object):
+    """
+    Groups the texts of concurrent requests into batches that are vectorized and predicted
+    together. A batch is closed when it has `batch_size` texts or `max_delay` seconds after
+    its first request arrived, so both bound the latency added to a request.
+
+    :param textmodel: Text model
+    :type textmodel: microtc.textmodel.TextModel
+    :param classifier: Classifier, its :py:func:`microtc.wrappers.ClassifierWrapper.predictor` is used when available
+    :type classifier: microtc.wrappers.ClassifierWrapper
+    :param le: Label encoder, None on regression
+    :type le: sklearn.preprocessing.LabelEncoder
+    :param batch_size: Maximum number of texts in a batch
+    :type batch_size: int
+    :param max_delay: Maximum time (seconds) a request waits for other requests
+    :type max_delay: float
+
+    Usage:
+
+    >>> from microtc.server import MicroBatcher
+    >>> from microtc.textmodel import TextModel
+    >>> from microtc.wrappers import ClassifierWrapper
+    >>> from sklearn.preprocessing import LabelEncoder
+    >>> corpus = ['buenos dias', 'malos dias', 'buenas tardes', 'malas noches']
+    >>> le = LabelEncoder().fit(['neg', 'pos'])
+    >>> textmodel = TextModel().fit(corpus)
+    >>> c = ClassifierWrapper().fit(textmodel.transform(corpus), le.transform(['pos', 'neg', 'pos', 'neg']))
+    >>> batcher = MicroBatcher(textmodel, c, le=le)
+    >>> [x['klass'] for x in batcher.submit(['buenos dias', 'malas noches'])]
+    ['pos', 'neg']
+    >>> batcher.close()
+    """
+
+    def __init__(self, textmodel, classifier, le=None, batch_size=64, max_delay=0.005):
+        self.textmodel = textmodel
+        try:
+            self.classifier = classifier.predictor()
+        except AttributeError:
+            # classifiers without coef_
+            self.classifier = classifier
+        self.le = le
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._nrequests = 0
+        self._ntexts = 0
+        self._nbatches = 0
+        self._latency = deque(maxlen=10000)
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def submit(self, texts):
+        """Predicts a list of texts, it waits for the batch containing them
+
+        :param texts: Texts or dictionaries with the text
+        :type texts: list
+        :rtype: list
+        """
+
+        item = dict(texts=texts, start=time(), event=threading.Event())
+        self._queue.put(item)
+        item['event'].wait()
+        if 'error' in item:
+            raise item['error']
+        return item['output']
+
+    def close(self):
+        """Stops the thread of the batches"""
+
+        self._queue.put(None)
+        self._thread.join()
+
+    def stats(self):
+        """Number of requests, texts, and batches; mean batch size, and percentiles of the latency (milliseconds)
+
+        :rtype: dict
+        """
+
+        with self._lock:
+            latency = np.array(self._latency) * 1000
+            output = dict(requests=self._nrequests, texts=self._ntexts, batches=self._nbatches,
+                          batch_size=self._ntexts / max(self._nbatches, 1))
+        for p in [50, 90, 99]:
+            output['latency_p%d' % p] = float(np.percentile(latency, p)) if latency.shape[0] else 0.0
+        return output
+
+    def _loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            size = len(item['texts'])
+            deadline = item['start'] + self.max_delay
+            while size < self.batch_size:
+                timeout = deadline - time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)
+                    break
+                batch.append(item)
+                size += len(item['texts'])
+            self._process(batch)
+
+    def _process(self, batch):
+        texts = [x for item in batch for x in item['texts']]
+        try:
+            output = self.predict(texts)
+        except Exception as e:
+            if len(batch) > 1:
+                # each request is predicted alone, so only the malformed ones fail
+                for item in batch:
+                    self._process([item])
+                return
+            for item in batch:
+                item['error'] = e
+                item['event'].set()
+            return
+
+        start = 0
+        end = time()
+        with self._lock:
+            self._nbatches += 1
+            self._ntexts += len(texts)
+            self._nrequests += len(batch)
+            self._latency.extend([end - item['start'] for item in batch])
+        for item in batch:
+            item['output'] = output[start:start + len(item['texts'])]
+            start += len(item['texts'])
+            item['event'].set()
+
+    def predict(self, texts):
+        """Labels and decision functions (values on regression) of the texts
+
+        :param texts: Texts or dictionaries with the text
+        :type texts: list
+        :rtype: list
+        """
+
+        if len(texts) == 0:
+            return []
+        X = self.textmodel.transform(texts)
+        if self.le is None:
+            return [{VALUE: float(v)} for v in self.classifier.predict(X)]
+        hy = self.classifier.decision_function(X)
+        # the labels come from the decision function, it is not computed twice
+        classes = getattr(self.classifier, 'classes', None)
+        if classes is None:
+            # classifiers without coef_ (see __init__)
+            classes = getattr(self.classifier, 'svc', self.classifier).classes_
+        klass = self.le.inverse_transform(decision_labels(hy, classes))
+        return [{KLASS: str(k), 'decision_function': np.atleast_1d(d).tolist()} for k, d in zip(klass, hy)]
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    """POST / (or /predict) with a text, a dictionary, or a list of them (JSON) answers the
+    prediction of each one; GET /stats answers :py:func:`MicroBatcher.stats`"""
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/stats':
+            return self._answer(200, self.server.batcher.stats())
+        self._answer(404, dict(error='unknown path %s' % self.path))
+
+    def do_POST(self):
+        if self.path.rstrip('/') not in ('', '/predict'):
+            return self._answer(404, dict(error='unknown path %s' % self.path))
+        try:
+            size = int(self.headers.get('Content-Length', 0))
+            data = json.loads(self.rfile.read(size).decode('utf-8'))
+        except ValueError as e:
+            return self._answer(400, dict(error=str(e)))
+        texts = data if isinstance(data, list) else [data]
+        try:
+            output = self.server.batcher.submit(texts)
+        except Exception as e:
+            return self._answer(500, dict(error=str(e)))
+        self._answer(200, output if isinstance(data, list) else output[0])
+
+    def _answer(self, code, output):
+        output = json.dumps(output).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(output)))
+        self.end_headers()
+        self.wfile.write(output)
+
+    def address_string(self):
+        # the address of a Unix socket is an empty string
+        return str(self.client_address[0]) if self.client_address else self.server.server_address
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super(PredictionHandler, self).log_message(format, *args)
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(batcher, host='127.0.0.1', port=8000, unix_socket=None, verbose=False):
+    """HTTP server answering the predictions of `batcher`, on a TCP port or on a Unix socket
+
+    :param batcher: Micro batcher
+    :type batcher: MicroBatcher
+    :param host: Host
+    :type host: str
+    :param port: Port (0 selects a free port)
+    :type port: int
+    :param unix_socket: Path of the Unix socket, it replaces host and port; an existing
+                        socket is replaced, any other file raises FileExistsError
+    :type unix_socket: str
+    :param verbose: Log the requests
+    :type verbose: bool
+    :rtype: socketserver.BaseServer
+    """
+
+    if unix_socket is not None:
+        if os.path.exists(unix_socket):
+            # only the socket of a previous server is removed, never a regular file
+            if not stat.S_ISSOCK(os.stat(unix_socket).st_mode):
+                raise FileExistsError("%s exists and it is not a socket" % unix_socket)
+            os.unlink(unix_socket)
+        server = ThreadingUnixHTTPServer(unix_socket, PredictionHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), PredictionHandler)
+    server.batcher = batcher
+    server.verbose = verbose
+    return server
@@ -33,3 +33,23 @@ def test_predict_from_file():
     for i in hy:
         assert i in ['POS', 'NEU', 'NEG']
 
+
+
+def test_linear_predictor():
+    from microtc.wrappers import ClassifierWrapper, RegressorWrapper
+    from microtc.textmodel import TextModel
+    from microtc.utils import read_data_labels, tweet_iterator
+    import numpy as np
+    import os
+    fname = os.path.dirname(__file__) + '/text.json'
+    corpus, labels = read_data_labels(fname)
+    t = TextModel(token_list=[-1, 3]).fit(corpus)
+    X = t.transform(corpus)
+    c = ClassifierWrapper().fit(X, labels)
+    p = c.predictor()
+    assert np.allclose(p.decision_function(X), c.decision_function(X), atol=1e-5)
+    assert np.all(p.predict(X) == c.predict(X))
+    assert np.all(p.predict([t[corpus[0]]]) == c.predict(X[:1]))
+    y = [x['value'] for x in tweet_iterator(fname)]
+    r = RegressorWrapper().fit(X, y)
+    assert np.allclose(r.predictor().predict(X), r.predict(X), atol=1e-5)
@@ -227,3 +227,126 @@ def test_kfolds():
     except AssertionError:
         return
     assert False
+
+
+def test_retrain_update_textmodel():
+    from microtc.command_line import train, retrain
+    import os
+    import tempfile
+    output = tempfile.mktemp()
+    fname = os.path.dirname(__file__) + '/text.json'
+    conf = '{"token_list": [-1, 3], "weighting": "entropy"}'
+    textmodel, _, _ = train('-m', output, '--conf', conf, '-o', output, fname)
+    num_terms = textmodel.num_terms
+    textmodel, c, _ = retrain('-m', output, '-u', '-o', output + '.model', fname)
+    assert textmodel.num_terms == num_terms
+    assert textmodel.model._ndocs == 2 * len(list(open(fname)))
+    assert c.num_terms == num_terms
+    os.unlink(output)
+    os.unlink(output + '.model')
+
+
+def test_predict_stream():
+    from microtc.command_line import train, predict
+    from microtc.utils import tweet_iterator
+    import io
+    import os
+    import sys
+    import json
+    import tempfile
+    output = tempfile.mktemp()
+    fname = os.path.dirname(__file__) + '/text.json'
+    textmodel, c, le = train('-m', output, '--conf', '{"token_list": [-1, 3]}', '-o', output, fname)
+    tw = list(tweet_iterator(fname))
+    hy = le.inverse_transform(c.predict(textmodel.transform(tw)))
+    stdin, stdout = sys.stdin, sys.stdout
+    sys.stdin = open(fname)
+    sys.stdout = io.StringIO()
+    try:
+        L = predict('-m', output, '-b', '7', '-', keep=False)
+        lines = sys.stdout.getvalue().split('\n')
+    finally:
+        sys.stdin.close()
+        sys.stdin, sys.stdout = stdin, stdout
+    assert len(L) == 0
+    assert lines[-1] == ''
+    lines = [json.loads(x) for x in lines[:-1]]
+    assert len(lines) == len(tw)
+    for a, b, k in zip(lines, tw, hy):
+        assert a['text'] == b['text'] and a['klass'] == k
+    L = predict('-m', output, '-b', '3', '-n', '2', '-o', output + '.predicted', fname)
+    assert [x['text'] for x in L] == [x['text'] for x in tweet_iterator(output + '.predicted')]
+    for a, b, k in zip(L, tw, hy):
+        assert a['text'] == b['text'] and a['klass'] == k
+    os.unlink(output)
+    os.unlink(output + '.predicted')
+
+
+def test_serve():
+    from microtc.command_line import train, serve
+    from microtc.server import make_server
+    from microtc.utils import tweet_iterator
+    from urllib.request import urlopen
+    import socket
+    import threading
+    import json
+    import os
+    import tempfile
+    output = tempfile.mktemp()
+    fname = os.path.dirname(__file__) + '/text.json'
+    textmodel, c, le = train('-m', output, '--conf', '{"token_list": [-1, 3]}', '-o', output, fname)
+    server = serve('-m', output, '-p', '0', '-b', '4', '-d', '50', run=False)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = 'http://127.0.0.1:%d' % server.server_address[1]
+    tw = list(tweet_iterator(fname))
+    hy = le.inverse_transform(c.predict(textmodel.transform(tw)))
+    output_ = [None] * len(tw)
+
+    def request(i):
+        with urlopen(url + '/predict', data=json.dumps(tw[i]).encode('utf-8')) as r:
+            output_[i] = json.loads(r.read().decode('utf-8'))
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(len(tw))]
+    [x.start() for x in threads]
+    [x.join() for x in threads]
+    assert [x['klass'] for x in output_] == hy.tolist()
+    with urlopen(url, data=json.dumps([x['text'] for x in tw]).encode('utf-8')) as r:
+        assert [x['klass'] for x in json.loads(r.read().decode('utf-8'))] == hy.tolist()
+    with urlopen(url + '/stats') as r:
+        stats = json.loads(r.read().decode('utf-8'))
+    assert stats['texts'] == 2 * len(tw) and stats['batches'] < len(tw) + 1
+    # a malformed request does not fail the requests batched with it
+    output_ = [None, None]
+
+    def submit(i, texts):
+        try:
+            output_[i] = server.batcher.submit(texts)
+        except KeyError as e:
+            output_[i] = e
+
+    threads = [threading.Thread(target=submit, args=(0, [dict(txt='x')])),
+               threading.Thread(target=submit, args=(1, tw[:2]))]
+    [x.start() for x in threads]
+    [x.join() for x in threads]
+    assert isinstance(output_[0], KeyError)
+    assert [x['klass'] for x in output_[1]] == hy[:2].tolist()
+    server.shutdown()
+    server.server_close()
+    if hasattr(socket, 'AF_UNIX'):
+        # an existing socket is replaced, a regular file is not removed
+        sock = tempfile.mktemp()
+        make_server(server.batcher, unix_socket=sock).server_close()
+        make_server(server.batcher, unix_socket=sock).server_close()
+        os.unlink(sock)
+        with open(sock, 'w') as fpt:
+            fpt.write('data')
+        try:
+            make_server(server.batcher, unix_socket=sock)
+            assert False
+        except FileExistsError:
+            pass
+        assert open(sock).read() == 'data'
+        os.unlink(sock)
+    server.batcher.close()
+    os.unlink(output)
@@ -197,3 +197,167 @@ def test_textmodel_save_load():
     os.unlink('t.model')
     
     
+
+
+def test_transformation_plan():
+    import re
+    import itertools
+    from microtc.params import BASIC_OPTIONS, OPTION_DELETE, OPTION_GROUP
+    from microtc.textmodel import get_transformation_plan, apply_transformation_plan
+
+    def sequential(text, hashtag_option, ent_option, lc, num_option, url_option, usr_option):
+        for option, regex, repl in [(hashtag_option, r"#\S+", "_htag"), (ent_option, r"[A-Z][a-z]+", "_ent"),
+                                    (lc, None, None), (num_option, r"\d+\.?\d+", "_num"),
+                                    (url_option, r"https?://\S+", "_url"), (usr_option, r"@\S+", "_usr")]:
+            if regex is None:
+                text = text.lower() if lc else text
+            elif option == OPTION_GROUP:
+                text = re.sub(regex, repl, text)
+            elif option == OPTION_DELETE:
+                text = re.sub(regex, "", text)
+        return text
+
+    texts = ["@Juan 12.5 #Hola http://t.co/X HTtp://a.b", "@12 http://#x @http://y 1Ab2 ht12tp://z",
+             "ΑΣ12b ΑΣhttp://x İ@x #tag@usr", ""]
+    for options in itertools.product(BASIC_OPTIONS, BASIC_OPTIONS, [True, False],
+                                     BASIC_OPTIONS, BASIC_OPTIONS, BASIC_OPTIONS):
+        plan = get_transformation_plan(*options)
+        for text in texts:
+            assert apply_transformation_plan(plan, text) == sequential(text, *options)
+
+
+def test_norm_chars():
+    from microtc.textmodel import norm_chars
+    assert norm_chars("~Holaaa  ~~camión!!") == '~Hola~~camion!~'
+    assert norm_chars("Holaaa  camión!!", del_dup=False, del_diac=False) == '~Holaaa~~camión!!~'
+    assert norm_chars("a..b ~c", del_punc=True) == '~ab~c~'
+
+
+def test_textmodel_shared_emoticons():
+    import pickle
+    from microtc.textmodel import TextModel
+    from microtc.emoticons import get_emoticon_classifier
+    a = TextModel(emo_option='group')
+    b = TextModel(emo_option='delete')
+    assert a.emo_map is b.emo_map
+    assert TextModel(emo_option='none').emo_map is None
+    c = pickle.loads(pickle.dumps(a))
+    assert c.emo_map is get_emoticon_classifier()
+    assert len(pickle.dumps(a)) < 1024
+
+
+def test_emoticons_replace():
+    from microtc.emoticons import get_emoticon_classifier
+    emo = get_emoticon_classifier()
+    assert emo.replace("hola :) xD adios") == 'hola _pos _pos adios'
+    assert emo.replace("hola :) XD adios", option='delete') == 'hola   adios'
+    assert emo.replace("hola :) xD", option='none') == 'hola :) xD'
+    # a code must be followed by at least one character
+    assert emo.replace("hola :)") == 'hola :)'
+    assert emo.replace("xDx :)!") == 'xDx _pos!'
+
+
+def test_textmodel_fit_transform():
+    from microtc.textmodel import TextModel
+    from microtc.utils import tweet_iterator
+    import numpy as np
+    import os
+    fname = os.path.dirname(__file__) + '/text.json'
+    tw = list(tweet_iterator(fname))
+    for w in ['tfidf', 'tf', 'entropy']:
+        tm = TextModel(token_list=[-1, 3], weighting=w)
+        X = tm.fit_transform(tw)
+        Y = TextModel(token_list=[-1, 3], weighting=w).fit(tw).transform(tw)
+        assert X.shape == Y.shape == (len(tw), tm.model.num_terms)
+        assert np.fabs((X - Y).toarray()).max() == 0
+
+
+def test_textmodel_hash_size():
+    from microtc.textmodel import TextModel
+    from microtc.utils import tweet_iterator
+    import os
+    fname = os.path.dirname(__file__) + '/text.json'
+    tw = list(tweet_iterator(fname))
+    for w in ['tfidf', 'tf', 'entropy']:
+        text = TextModel(token_list=[-1, 3], weighting=w, hash_size=2**12)
+        X = text.fit_transform(tw)
+        assert X.shape == (len(tw), 2**12)
+        assert text.num_terms == 2**12
+        assert len(text[tw[0]]) == X[0].nnz
+
+
+def test_textmodel_tokenize_ids():
+    from microtc.textmodel import TextModel
+    from microtc.weighting import hash_tokens
+    from microtc.utils import tweet_iterator
+    import numpy as np
+    import os
+    fname = os.path.dirname(__file__) + '/text.json'
+    tw = list(tweet_iterator(fname))
+    for token_list in [[-2, -1], [1, 2, 3, 5], [(2, 1), (3, 1), -3, 4], [(2, 2)]]:
+        for select_suff in [False, True]:
+            text = TextModel(token_list=token_list, select_suff=select_suff)
+            for t in tw + [dict(text='')]:
+                assert np.all(hash_tokens(text.tokenize(t)) == text.tokenize_ids(t))
+    reverse = dict()
+    h = text.tokenize_ids(tw[0], reverse=reverse)
+    assert [reverse[x] for x in h.tolist()] == text.tokenize(tw[0])
+
+
+def test_textmodel_transform_n_jobs():
+    from microtc.textmodel import TextModel
+    from microtc.utils import tweet_iterator
+    import os
+    fname = os.path.dirname(__file__) + '/text.json'
+    tw = list(tweet_iterator(fname))
+    text = TextModel(token_list=[-1, 3]).fit(tw)
+    X = text.transform(tw)
+    X2 = text.transform(tw, n_jobs=2, chunksize=2)
+    assert X.shape == X2.shape
+    assert (X != X2).nnz == 0
+
+
+def test_textmodel_fit_stream():
+    from microtc.textmodel import TextModel
+    from microtc.utils import tweet_iterator
+    import os
+
+    class Corpus(object):
+        def __iter__(self):
+            return tweet_iterator(fname)
+
+    fname = os.path.dirname(__file__) + '/text.json'
+    tw = list(tweet_iterator(fname))
+    for w, hash_size in [('tfidf', None), ('tfidf', 2**10), ('entropy', None)]:
+        text = TextModel(token_list=[-1, 3], weighting=w, hash_size=hash_size).fit(tw)
+        text2 = TextModel(token_list=[-1, 3], weighting=w, hash_size=hash_size).fit(Corpus())
+        assert text.num_terms == text2.num_terms
+        assert (text.transform(tw) != text2.transform(tw)).nnz == 0
+    text = TextModel(token_list=[-1, 3]).fit(tweet_iterator(fname))
+    assert text.num_terms == text2.num_terms
+    try:
+        TextModel(weighting='entropy').fit(tweet_iterator(fname))
+        assert False
+    except ValueError:
+        pass
+
+
+def test_textmodel_fit_n_jobs():
+    from microtc.textmodel import TextModel
+    from microtc.utils import tweet_iterator
+    import numpy as np
+    import os
+    fname = os.path.dirname(__file__) + '/text.json'
+    tw = list(tweet_iterator(fname))
+    for w in ['tfidf', 'entropy']:
+        text = TextModel(token_list=[-1, 3], weighting=w, token_min_filter=1).fit(tw)
+        text2 = TextModel(token_list=[-1, 3], weighting=w, token_min_filter=1).fit(tw, n_jobs=2, chunksize=2)
+        assert text.model.word2id.items() == text2.model.word2id.items()
+        assert np.all(text.model.wordWeight == text2.model.wordWeight)
+    # entropy fails before the workers consume the iterator
+    X = iter(tw)
+    try:
+        TextModel(token_list=[-1, 3], weighting='entropy').fit(X, n_jobs=2)
+        assert False
+    except ValueError:
+        assert next(X) == tw[0]
@@ -15,6 +15,16 @@ def test_params():
     sel.search(fake_score, bsize=64)
 
 
+def test_params_custom():
+    from microtc.params import ParameterSelection, DefaultParams, Fixed
+    params = {k: v for k, v in DefaultParams.items() if k not in ('hash_size', 'max_terms', 'sketch_width')}
+    sel = ParameterSelection(params=params)
+    assert isinstance(sel.params['hash_size'], Fixed) and sel.params['hash_size'].value is None
+    assert 'hash_size' not in params
+    conf = next(sel.sample_param_space(1))
+    assert conf['max_terms'] is None and conf['sketch_width'] is None
+
+
 def test_read_data_labels():
     import os
     from microtc.utils import read_data_labels
@@ -38,3 +48,162 @@ def test_wrapper_score():
     print(conf['_avgf1:0:2'], (f1[0] + f1[2]) / 2.)
     assert conf['_avgf1:0:2'] == (f1[0] + f1[2]) / 2.
 
+
+def test_wrapper_textmodel_klasses():
+    import os
+    from microtc.scorewrapper import ScoreSampleWrapper
+    from microtc.utils import read_corpus
+    fname = os.path.join(os.path.dirname(__file__), "text.json")
+    X, y = read_corpus(fname)
+    os.environ['TEXTMODEL_KLASSES'] = 'POS,NEG'
+    try:
+        conf = ScoreSampleWrapper(X, y, ratio=0.5)((dict(token_list=[-1, 3]), None))
+    finally:
+        del os.environ['TEXTMODEL_KLASSES']
+    assert '_score' in conf
+
+
+def test_save_load_model():
+    import os
+    import gzip
+    import pickle
+    import tempfile
+    import numpy as np
+    from microtc.textmodel import TextModel
+    from microtc.utils import tweet_iterator, save_model, load_model
+    fname = os.path.join(os.path.dirname(__file__), "text.json")
+    tw = list(tweet_iterator(fname))
+    tm = TextModel(token_list=[-1, 3], weighting='entropy').fit(tw)
+    output = tempfile.mktemp()
+    save_model([tm, 1], output)
+    tm2, one = load_model(output)
+    assert one == 1
+    # the arrays are read from the mapped file
+    assert not tm2.model.wordWeight.flags.owndata
+    assert (tm.transform(tw) != tm2.transform(tw)).nnz == 0
+    tm2.partial_fit(tw)
+    assert tm2.model._ndocs == 2 * len(tw)
+    # the model is written over the file it is mapped from
+    save_model([tm2, 1], output)
+    assert load_model(output)[0].model._ndocs == 2 * len(tw)
+    tm3, _ = load_model(output, mmap=False)
+    assert tm3.model.wordWeight.flags.writeable
+    assert (tm2.transform(tw) != tm3.transform(tw)).nnz == 0
+    # the map is closed with the last array using it
+    del tm2
+    with gzip.open(output, 'w') as fpt:
+        pickle.dump(tm, fpt)
+    assert (tm.transform(tw) != load_model(output).transform(tw)).nnz == 0
+    os.unlink(output)
+
+
+def test_read_corpus():
+    import os
+    import json
+    import gzip
+    import tempfile
+    from microtc.utils import json_blocks, read_corpus, read_data_labels
+    fname = os.path.join(os.path.dirname(__file__), "text.json")
+    X, y = read_data_labels(fname)
+    tweets, labels = read_corpus(fname)
+    assert labels == y and [x['text'] for x in tweets] == X
+    output = tempfile.mktemp() + '.gz'
+    with gzip.open(output, 'wb') as fpt:
+        for tw in tweets:
+            fpt.write(json.dumps(tw).encode('utf-8') + b'\n\n')
+    blocks = list(json_blocks(output, blocksize=100))
+    assert len(blocks) > 1
+    assert [x for block in blocks for x in block] == tweets
+    tweets, labels = read_corpus(output, maxitems=5)
+    assert len(tweets) == 5 and labels == y[:5]
+    os.unlink(output)
+    # each line is a document, the errors report the line
+    output = tempfile.mktemp()
+    for blocksize in [1 << 22, 10]:
+        with open(output, 'w') as fpt:
+            fpt.write('{"text": "a"}\n\n{"text": "b"}\n{"text": "c"}, {"text": "d"}\n')
+        try:
+            list(json_blocks(output, blocksize=blocksize))
+            assert False
+        except ValueError as e:
+            assert '%s, line 4' % output in str(e)
+    os.unlink(output)
+
+
+def test_corpus_cache():
+    import os
+    import shutil
+    import tempfile
+    from microtc.cache import CorpusCache
+    from microtc.emoticons import get_emoticon_classifier
+    from microtc.textmodel import TextModel
+    from microtc.scorewrapper import ScoreKFoldWrapper
+    from microtc.utils import read_corpus
+    fname = os.path.join(os.path.dirname(__file__), "text.json")
+    X, y = read_corpus(fname)
+    path = tempfile.mkdtemp()
+    cache = CorpusCache(path)
+    tm = TextModel(token_list=[-2, -1, 3, (2, 1)], emo_option='delete')
+    for i in range(2):
+        # the second time the entries are read from the disk
+        normalized = cache.normalize(X, tm)
+        assert [x['klass'] for x in normalized] == y
+        assert [tm.tokenize(x) for x in normalized] == [tm.tokenize(x) for x in X]
+    assert len(os.listdir(path)) == 1
+    assert cache.key(cache.digest(X), TextModel(lc=False)) != cache.key(cache.digest(X), TextModel())
+    # the emoticons' table is part of the key
+    emoticons = os.path.join(path, 'emoticons.json')
+    with open(emoticons, 'w') as fpt:
+        fpt.write('{":)": "_pos", "xd": "_pos"}')
+    tm2 = TextModel(token_list=[-2, -1, 3, (2, 1)], emo_option='delete')
+    tm2.emo_map = get_emoticon_classifier(emoticons)
+    assert cache.key(cache.digest(X), tm2) != cache.key(cache.digest(X), tm)
+    os.unlink(emoticons)
+    conf = dict(token_list=[-1, 3])
+    score = ScoreKFoldWrapper(X, y, nfolds=2, random_state=1)((dict(conf), None))
+    score2 = ScoreKFoldWrapper(X, y, nfolds=2, random_state=1, cache=cache)((dict(conf), None))
+    assert score['_score'] == score2['_score']
+    # only the last entry fits
+    cache.max_size = os.path.getsize(cache.filename(cache.key(cache.digest(X), tm)))
+    tm = TextModel(del_diac=False)
+    cache.normalize(X, tm)
+    assert os.listdir(path) == [cache.key(cache.digest(X), tm) + '.npz']
+    shutil.rmtree(path)
+
+
+def test_preprocessing_memo():
+    import os
+    from microtc.cache import MEMO, PreprocessingMemo
+    from microtc.scorewrapper import ScoreKFoldWrapper, ScoreSampleWrapper
+    from microtc.regscorewrapper import RegressionScoreKFoldWrapper
+    from microtc.textmodel import TextModel
+    from microtc.utils import read_corpus
+    fname = os.path.join(os.path.dirname(__file__), "text.json")
+    X, y = read_corpus(fname)
+    MEMO.clear()
+    conf = dict(token_list=[-1, 3], del_diac=False)
+    kfold = ScoreKFoldWrapper(X, y, nfolds=2, random_state=1)
+    score = kfold((dict(conf), None))['_score']
+    assert len(MEMO) == 1
+    # only the tokenizers and the weighting change
+    kfold((dict(conf, token_list=[2, 4], weighting='tf'), None))
+    assert len(MEMO) == 1
+    assert kfold((dict(conf), None))['_score'] == score
+    ScoreSampleWrapper(X, y, ratio=0.5)((dict(conf), None))
+    assert len(MEMO) == 2
+    RegressionScoreKFoldWrapper(X, [x['value'] for x in X], nfolds=2)((dict(conf), None))
+    assert len(MEMO) == 2
+    normalized = MEMO.normalize(X, TextModel(lc=False))
+    assert len(MEMO) == 3
+    # only the text and the label are kept
+    assert [sorted(x.keys()) for x in normalized] == [['klass', 'text']] * len(X)
+    assert [x['klass'] for x in normalized] == y
+    MEMO.clear()
+    # the corpora least recently used are removed when they exceed max_size bytes
+    memo = PreprocessingMemo()
+    memo.normalize(X, TextModel())
+    memo.max_size = memo.nbytes
+    memo.normalize(X, TextModel(lc=False))
+    assert len(memo) == 1 and memo.nbytes <= memo.max_size
+    memo.normalize(X, TextModel(lc=False))
+    assert len(memo) == 1
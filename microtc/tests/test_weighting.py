@@ -77,7 +77,7 @@ def test_entropy():
     sp = Entropy(docs, X=tw)
     print(sp.wordWeight)
     tfidf = TFIDF(docs)
-    for k in sp.wordWeight.keys():
+    for k in range(len(sp.wordWeight)):
         if sp.wordWeight[k] != tfidf.wordWeight[k]:
             return
     print(sp.w)
@@ -85,3 +85,260 @@ def test_entropy():
 
 
     
+
+
+def test_transform():
+    from microtc.textmodel import TextModel
+    from microtc.weighting import TFIDF, TF, Entropy
+    from microtc.utils import tweet_iterator
+    import numpy as np
+    import os
+    fname = os.path.dirname(__file__) + '/text.json'
+    tw = list(tweet_iterator(fname))
+    text = TextModel(token_list=[-1, 3])
+    docs = [text.tokenize(d) for d in tw] + [['~'], []]
+    for klass in [TFIDF, TF, Entropy]:
+        sp = klass(docs[:len(tw)], X=tw)
+        X = sp.transform(docs)
+        assert X.shape == (len(docs), sp.num_terms)
+        for r, tokens in enumerate(docs):
+            row = X[r]
+            vec = {k: v for k, v in sp[tokens] if np.isfinite(v)}
+            assert sorted(vec.keys()) == sorted(row.indices)
+            for k, v in zip(row.indices, row.data):
+                assert np.fabs(vec[k] - v) < 1e-12
+
+
+def test_vocabulary():
+    from microtc.weighting import Vocabulary
+    import pickle
+    w2id = {'hola': 0, 'adiós': 1, 'a\x00': 2, '~': 3, 'ab': 4, 'ba': 5}
+    voc = Vocabulary(w2id)
+    assert len(voc) == len(w2id)
+    for k, v in w2id.items():
+        assert voc[k] == v
+    assert 'x' not in voc and 'a' not in voc
+    assert voc.lookup(['ba', 'x', 'adiós', 'a\x00']).tolist() == [5, -1, 1, 2]
+    assert voc.lookup(['hola', 'x' * 3000, '~']).tolist() == [0, -1, 3]
+    assert dict(voc.items()) == w2id
+    voc = pickle.loads(pickle.dumps(voc))
+    assert voc.lookup(['hola', 'ab']).tolist() == [0, 4]
+
+
+def test_hash_tokens():
+    from microtc.weighting import hash_tokens, HASH_BASE
+    import tracemalloc
+
+    def naive(token):
+        h = 0
+        for c in token:
+            h = (h * int(HASH_BASE) + ord(c)) % (1 << 64)
+        return h
+
+    tokens = ['ab', '', 'adiós', '~b', 'x' * 300, 'ab']
+    assert hash_tokens(tokens).tolist() == [naive(x) for x in tokens]
+    # one long token does not pad the rest
+    tokens = ['ab'] * 4095 + ['x' * 20000]
+    tracemalloc.start()
+    h = hash_tokens(tokens)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert peak < (16 << 20)
+    assert h[0] == naive('ab') and h[-1] == naive(tokens[-1])
+
+
+def test_entropy_klasses():
+    from microtc.weighting import Entropy
+    from collections import Counter
+    import numpy as np
+    docs = [['a', 'b', 'a'], ['b', 'c'], ['c'], ['a', 'd'], ['d', 'd', 'b'], ['e']]
+    y = [0, 1, 2, 0, 1, 2]
+    X = [dict(klass=k) for k in y]
+    w2id = {k: i for i, k in enumerate('abcd')}
+    weight = np.zeros((3, len(w2id)))
+    for k, tokens in zip(y, docs):
+        for token in Counter(tokens):
+            if token in w2id:
+                weight[k, w2id[token]] += 1
+    p = weight / weight.sum(axis=0)
+    logc = np.log2(p)
+    logc[~np.isfinite(logc)] = 0
+    expected = 1 + (p * logc / np.log2(3)).sum(axis=0)
+    assert np.allclose(Entropy.entropy(docs, X, w2id), expected)
+
+
+def test_hashing():
+    from microtc.weighting import TFIDF, HashingVocabulary
+    import numpy as np
+    docs = [['a', 'b', 'a'], ['b', 'c'], ['c'], ['a', 'd'], ['d', 'd', 'b']]
+    voc = HashingVocabulary(1024)
+    ids, sign = voc.lookup(['a', 'b', 'a'], sign=True)
+    assert ids[0] == ids[2] and np.all(np.abs(sign) == 1)
+    tfidf = TFIDF(docs, hash_size=1024)
+    assert tfidf.num_terms == 1024
+    assert tfidf.word2id.mask.sum() == 4
+    X = tfidf.transform(docs)
+    assert X.shape == (5, 1024)
+    for i, tokens in enumerate(docs):
+        r = dict(tfidf[tokens])
+        assert np.allclose([r[j] for j in X[i].indices], X[i].data)
+        assert np.isclose(np.linalg.norm(X[i].data), 1)
+    tfidf = TFIDF(docs, hash_size=1024, token_min_filter=2)
+    assert tfidf.word2id.mask.sum() == 1
+    assert tfidf.word2id.get('b') is not None and tfidf.word2id.get('a') is None
+
+
+def test_partial_fit():
+    from microtc.weighting import TFIDF, TF, Entropy
+    import numpy as np
+    docs = [['a', 'b', 'a'], ['b', 'c'], ['c'], ['a', 'd'], ['d', 'd', 'b'], ['e', 'a']]
+    X = [dict(klass=k) for k in [0, 1, 2, 0, 1, 2]]
+    for klass in [TFIDF, TF, Entropy]:
+        model = klass(docs, X=X)
+        model2 = klass(docs[:3], X=X[:3]).partial_fit(docs[3:], X=X[3:])
+        assert model.num_terms == model2.num_terms
+        for token, ident in model.word2id.items():
+            assert model.wordWeight[ident] == model2.wordWeight[model2.word2id[token]]
+    model = TFIDF(docs, hash_size=128)
+    model2 = TFIDF(docs[:3], hash_size=128).partial_fit(docs[3:])
+    assert np.all(model.word2id.mask == model2.word2id.mask)
+    assert np.all(model.wordWeight[model.word2id.mask] == model2.wordWeight[model2.word2id.mask])
+    # the new tokens are appended in order of appearance
+    model = TFIDF(docs).partial_fit([['z', 'r', 'e', 'w', 'q', 'z'], ['q', 'x']])
+    assert [model.word2id[x] for x in ['z', 'r', 'w', 'q', 'x']] == list(range(5, 10))
+
+
+def test_max_terms():
+    from microtc.weighting import TFIDF, Entropy, heavy_hitters
+    import numpy as np
+    docs = [['a', 'b', 'a'], ['b', 'c'], ['c', 'b'], ['a', 'd'], ['d', 'd', 'b'], ['e', 'a']]
+    X = [dict(klass=k) for k in [0, 1, 2, 0, 1, 0]]
+    tokens, df, ndocs = heavy_hitters(docs, 2)
+    assert ndocs == len(docs) and len(tokens) <= 4
+    d = dict(zip(tokens, df))
+    assert d['a'] >= 3 and d['b'] >= 4
+    model = TFIDF(docs, max_terms=2)
+    assert model.num_terms == 2
+    assert set(model.word2id.keys()) == set(['a', 'b'])
+    full = TFIDF(docs)
+    for token, ident in model.word2id.items():
+        assert model.wordWeight[ident] == full.wordWeight[full.word2id[token]]
+    model = Entropy(docs, X=X, max_terms=2)
+    assert model.num_terms == 2 and model._klass_df.shape == (3, 2)
+    full = Entropy(docs, X=X)
+    for token, ident in model.word2id.items():
+        assert np.isclose(model.wordWeight[ident], full.wordWeight[full.word2id[token]])
+    model = TFIDF(docs, hash_size=64, max_terms=2)
+    assert model.word2id.mask.sum() == 2
+    more = [['f', 'g'], ['f', 'c'], ['f', 'h']]
+    for model in [TFIDF(docs, max_terms=2), Entropy(docs, X=X, max_terms=2),
+                  TFIDF(docs, hash_size=64, max_terms=2)]:
+        model.partial_fit(more, X=[dict(klass=k) for k in [0, 1, 0]])
+        assert model.active_terms().sum() == 2 and model._ndocs == 9
+    model = TFIDF(docs[:2], max_terms=2).partial_fit(more)
+    assert set(model.word2id.keys()) == set(['b', 'f'])
+    assert np.isclose(model.wordWeight[model.word2id['f']], np.log2(5 / 3))
+    model = Entropy(docs, X=X, max_terms=3).partial_fit(more, X=[dict(klass=k) for k in [0, 1, 0]])
+    assert model._klass_df.shape == (3, 3) and model._klass_df.sum(axis=0).tolist() == model._df.tolist()
+    model = TFIDF(docs, hash_size=64, token_min_filter=2).partial_fit([['e', 'x'], ['x']])
+    assert model.word2id.get('e') is None and model.word2id.get('x') is None
+    assert model.word2id.mask.sum() == 2
+
+
+def test_max_terms_hash_seed():
+    import os
+    import sys
+    import subprocess
+    fname = os.path.dirname(__file__) + '/text.json'
+    code = """
+import sys
+from microtc.textmodel import TextModel
+from microtc.utils import tweet_iterator
+tm = TextModel(token_list=[3], max_terms=50).fit(list(tweet_iterator(sys.argv[1])))
+print(' '.join(sorted(tm.model.word2id.keys())))
+"""
+    # the package is imported from this tree
+    path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    output = []
+    for seed in ['1', '2']:
+        env = dict(os.environ, PYTHONHASHSEED=seed, PYTHONPATH=path)
+        output.append(subprocess.check_output([sys.executable, '-c', code, fname], env=env))
+    assert output[0] == output[1] and len(output[0].split()) == 50
+
+
+def test_count_min_sketch():
+    from microtc.weighting import TFIDF, CountMinSketch
+    from microtc.textmodel import TextModel
+    from microtc.utils import tweet_iterator
+    import numpy as np
+    import os
+    fname = os.path.dirname(__file__) + '/text.json'
+    tw = list(tweet_iterator(fname))
+    docs = [TextModel(token_list=[-1, 2, 3]).tokenize(x) for x in tw]
+    sketch = CountMinSketch(64)
+    sketch.fit(docs)
+    df = TFIDF(docs)
+    tokens = df.word2id.keys()
+    assert np.all(sketch.estimate(tokens) >= df._df[df.word2id.lookup(tokens)])
+    for min_filter, max_filter in [(1, 1), (2, 1), (0.2, 0.9)]:
+        model = TFIDF(docs, token_min_filter=min_filter, token_max_filter=max_filter)
+        model2 = TFIDF(docs, token_min_filter=min_filter, token_max_filter=max_filter, sketch_width=64)
+        assert model.word2id.items() == model2.word2id.items()
+        assert np.all(model.wordWeight == model2.wordWeight)
+
+
+def test_count_matrix():
+    from microtc.counts import CountBlocks
+    from microtc.textmodel import TextModel
+    from microtc.utils import tweet_iterator
+    import numpy as np
+    import os
+    fname = os.path.dirname(__file__) + '/text.json'
+    tw = list(tweet_iterator(fname))
+    tw.append(dict(text='', klass='POS'))
+    blocks = CountBlocks()
+    train, test = np.array([3, 0, 9, 2, 6, 1, 8]), np.array([4, 5, 7])
+    for conf in [dict(token_list=[-1, 3]), dict(token_list=[3, -1, 1], weighting='entropy'),
+                 dict(token_list=[2, [2, 1], -2], token_min_filter=1, select_suff=True),
+                 dict(token_list=[-1, 2, 4], token_max_filter=0.5, select_conn=True, weighting='tf')]:
+        tm = TextModel(**conf)
+        X = tm.fit_transform([tw[i] for i in train])
+        T = tm.transform([tw[i] for i in test])
+        tm2 = TextModel(**conf)
+        X2, T2 = blocks.matrix(tw, tm2).fit_transform(tm2, tw, train, test)
+        assert X.shape == X2.shape and (X != X2).nnz == 0 and (T != T2).nnz == 0
+        assert tm2.num_terms == tm.num_terms
+    assert len(blocks) == 7
+
+
+def test_weighting_counts():
+    from microtc.counts import CountBlocks
+    from microtc.textmodel import TextModel
+    from microtc.utils import tweet_iterator
+    import numpy as np
+    import os
+    fname = os.path.dirname(__file__) + '/text.json'
+    tw = list(tweet_iterator(fname))
+    blocks = CountBlocks()
+    train, test = np.array([3, 0, 8, 2, 6, 1]), np.array([4, 5, 7])
+    matrix = blocks.matrix(tw, TextModel(token_list=[-1, 3]))
+    for conf in [dict(weighting='tfidf'), dict(weighting='entropy', token_min_filter=1),
+                 dict(weighting='tf', token_max_filter=0.5)]:
+        tm = TextModel(token_list=[-1, 3], **conf)
+        assert blocks.matrix(tw, tm) is matrix
+        X, T = matrix.fit_transform(tm, tw, train, test)
+        tokens = [tm.tokenize(tw[i]) for i in test]
+        counts = tm.model.counts(tokens)
+        assert (tm.model.transform_counts(counts) != T).nnz == 0
+        assert (tm.transform([tw[i] for i in test]) != T).nnz == 0
+        assert [tm.model.word2id[x] for x in tm.model.word2id.keys()] == list(range(tm.num_terms))
+    assert len(matrix._memo) == 2
+    # the memoized counts are part of the size, the matrices are removed before the blocks
+    matrix2 = blocks.matrix(tw, TextModel(token_list=[-1, 4]))
+    assert len(blocks._matrices) == 2 and len(blocks) == 3
+    blocks.max_size = blocks.nbytes - matrix.nbytes
+    assert blocks.matrix(tw, TextModel(token_list=[-1, 4])) is matrix2
+    assert list(blocks._matrices.values()) == [matrix2] and len(blocks) == 3
+    blocks.max_size = 0
+    blocks.matrix(tw, TextModel(token_list=[-1, 4]))
+    assert list(blocks._matrices.values()) == [matrix2] and len(blocks) == 1
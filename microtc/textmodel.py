@@ -14,11 +14,15 @@
 import re
 import unicodedata
 import numpy as np
+from functools import lru_cache
 from .params import OPTION_DELETE, OPTION_GROUP, OPTION_NONE
-from .emoticons import EmoticonClassifier
+from .emoticons import get_emoticon_classifier
 import os
-from scipy.sparse import csr_matrix
+from multiprocessing import cpu_count, Pool
+from scipy.sparse import csr_matrix, vstack
 from .utils import get_class
+from .weighting import HASH_BASE, hash_tokens, hash_concat, TFIDF
+from .weighting import chunks, document_frequency, merge_document_frequency
 
 
 PUNCTUACTION = ";:,.@\\-\"'/"
@@ -47,30 +51,61 @@ def get_word_list(text):
     return ("".join(L)).split()
 
 
+@lru_cache(maxsize=None)
+def get_norm_chars_regex(del_dup=True, del_punc=False):
+    """Regular expression matching the characters removed by :py:func:`norm_chars`.
+    A character is removed depending only on itself and on the previous character,
+    so all of them are found in a single pass.
+
+    :rtype: regex or None
+    """
+
+    L = []
+    if del_dup:
+        # a space is mapped to '~' so the '~' following a space (or the beginning) is a duplicate
+        L.append(r"(?:\A|(?<=[\n\r \t]))~+")
+    if del_punc:
+        L.append("[{0}]".format(re.escape(PUNCTUACTION + SYMBOLS)))
+    if del_dup:
+        # removing the first of two equal characters is the same as removing the second one
+        L.append(r"([^\n\r \t])(?=\1)")
+    if len(L) == 0:
+        return None
+    return re.compile("|".join(L))
+
+
+DIACRITICS = re.compile("[\u0300-\u036f]")
+SPACES = str.maketrans("\n\r \t", "~~~~")
+
+
 def norm_chars(text, del_diac=True, del_dup=True, del_punc=False):
-    L = ['~']
+    """Normalizes the characters of a text; spaces are replaced by '~' and the text is
+    surrounded by '~'
 
-    prev = '~'
-    for u in unicodedata.normalize('NFD', text):
-        if del_diac:
-            o = ord(u)
-            if 0x300 <= o and o <= 0x036F:
-                continue
-            
-        if u in ('\n', '\r', ' ', '\t'):
-            u = '~'
-        elif del_dup and prev == u:
-            continue
-        elif del_punc and u in SKIP_SYMBOLS:
-            prev = u
-            continue
+    :param text: Text
+    :type text: str
+    :param del_diac: Remove diacritics
+    :type del_diac: bool
+    :param del_dup: Remove duplicated characters
+    :type del_dup: bool
+    :param del_punc: Remove punctuation symbols
+    :type del_punc: bool
+    :rtype: str
 
-        prev = u
-        L.append(u)
+    >>> from microtc.textmodel import norm_chars
+    >>> norm_chars("Holaaa  camión!!")
+    '~Hola~~camion!~'
+    """
+
+    text = unicodedata.normalize('NFD', text)
+    if del_diac:
+        text = DIACRITICS.sub("", text)
 
-    L.append('~')
+    regex = get_norm_chars_regex(del_dup, del_punc)
+    if regex is not None:
+        text = regex.sub("", text)
 
-    return "".join(L)
+    return "~" + text.translate(SPACES) + "~"
 
 
 def expand_qgrams(text, qsize, output):
@@ -108,6 +143,215 @@ def expand_skipgrams_word_list(wlist, qsize, output, sep='~'):
     return output
 
 
+def encode_text(text):
+    """Code points of a text
+
+    :param text: Text
+    :type text: str
+    :rtype: np.array
+    """
+
+    return np.frombuffer(text.encode('utf-32-le', 'surrogatepass'), dtype=np.uint32).astype(np.uint64)
+
+
+def expand_qgram_hashes(codes, qsizes, output):
+    """Expands an encoded text into the hashes of its q-grams for all the sizes in `qsizes`
+    (see :py:func:`microtc.weighting.hash_tokens`). The hashes of size q are computed
+    from those of size q - 1 with one vector operation, i.e., no q-gram is built.
+
+    :param codes: Code points of the text (see :py:func:`encode_text`)
+    :type codes: np.array
+    :param qsizes: q-gram sizes
+    :type qsizes: list
+    :param output: Hashes of each size
+    :type output: dict
+    :rtype: dict
+
+    >>> from microtc.textmodel import encode_text, expand_qgram_hashes
+    >>> from microtc.weighting import hash_tokens
+    >>> H = expand_qgram_hashes(encode_text('~hola~'), [3], dict())
+    >>> (H[3] == hash_tokens(['~ho', 'hol', 'ola', 'la~'])).all()
+    True
+    """
+
+    h = codes
+    for q in range(1, max(qsizes) + 1):
+        if q > 1:
+            h = h[:-1] * HASH_BASE + codes[q-1:]
+        if q in qsizes:
+            output[q] = h
+
+    return output
+
+
+def expand_qgram_hashes_word_list(hashes, lengths, qsize):
+    """Hashes of the word q-grams (words joined with '~') given the hashes and lengths of the words"""
+    h = hashes
+    for q in range(1, qsize):
+        h = hash_concat(h[:-1], hashes[q:], lengths[q:])
+
+    return h
+
+
+def expand_skipgram_hashes_word_list(hashes, lengths, qsize):
+    """Hashes of the skipgrams given the hashes and lengths of the words"""
+    qsize, skip = qsize
+    n = hashes.shape[0] - (qsize + (qsize - 1) * skip) + 1
+    if n <= 0:
+        return hashes[:0]
+    h = hashes[:n]
+    for i in range(1, qsize):
+        start = i * (1 + skip)
+        h = hash_concat(h, hashes[start:start+n], lengths[start:start+n])
+
+    return h
+
+
+# (name, first characters, regular expression, replacement on OPTION_GROUP) in the order
+# the substitutions are applied, `None` marks the place where the text is lower cased;
+# the first element of the tuple is the set of characters starting a match
+TRANSFORMATIONS = [('hashtag_option', "#", r"#\S+", "_htag"),
+                   ('ent_option', "A-Z", r"[A-Z][a-z]+", "_ent"),
+                   None,
+                   ('num_option', r"\d", r"\d+\.?\d+", "_num"),
+                   ('url_option', "h", r"https?://\S+", "_url"),
+                   ('usr_option', "@", r"@\S+", "_usr")]
+
+
+@lru_cache(maxsize=None)
+def get_transformation_plan(hashtag_option=OPTION_NONE, ent_option=OPTION_NONE, lc=True,
+                            num_option=OPTION_NONE, url_option=OPTION_NONE, usr_option=OPTION_NONE):
+    """Compiles the substitutions of :py:func:`TextModel.text_transformations` into a plan.
+    Consecutive substitutions are fused into a single alternation, i.e., one pass over the text.
+    The chain is cut after a deletion (it can join text that a later expression would match)
+    and where the text is lower cased; lowering is moved to the beginning when entities
+    are not used because the remaining expressions do not depend on the case.
+
+    The plan is shared by all the models having the same options.
+
+    :rtype: tuple - each stage is either None (lower case) or a pair (regex, replacement)
+
+    >>> from microtc.textmodel import get_transformation_plan, apply_transformation_plan
+    >>> plan = get_transformation_plan(num_option='group', usr_option='group')
+    >>> apply_transformation_plan(plan, 'Hola @Mario 1234')
+    'hola _usr _num'
+    """
+
+    options = dict(hashtag_option=hashtag_option, ent_option=ent_option, num_option=num_option,
+                   url_option=url_option, usr_option=usr_option)
+    steps = list(TRANSFORMATIONS)
+    if not lc:
+        steps.remove(None)
+    elif ent_option == OPTION_NONE:
+        steps.remove(None)
+        steps.insert(0, None)
+
+    plan = []
+    group = []
+
+    def close():
+        if len(group) == 1:
+            _, _, regex, repl = group[0]
+            plan.append((re.compile(regex), repl))
+        elif len(group) > 1:
+            # the lookahead lets the engine skip the positions where no alternative can start
+            regex = "(?=[{0}])(?:{1})".format("".join([first for _, first, _, _ in group]),
+                                             "|".join(["(?P<{0}>{1})".format(name, regex)
+                                                       for name, _, regex, _ in group]))
+            plan.append((re.compile(regex), {name: repl for name, _, _, repl in group}))
+        group.clear()
+
+    for step in steps:
+        if step is None:
+            close()
+            plan.append(None)
+            continue
+        name, first, regex, repl = step
+        option = options[name]
+        if option == OPTION_NONE:
+            continue
+        if option == OPTION_DELETE:
+            repl = ""
+        group.append((name.split('_')[0], first, regex, repl))
+        if option == OPTION_DELETE:
+            close()
+    close()
+    return tuple(plan)
+
+
+def apply_transformation_plan(plan, text):
+    """Applies a plan computed by :py:func:`get_transformation_plan`
+
+    :param plan: Stages
+    :type plan: tuple
+    :param text: Text
+    :type text: str
+    :rtype: str
+    """
+
+    for stage in plan:
+        if stage is None:
+            text = text.lower()
+            continue
+        regex, repl = stage
+        if isinstance(repl, dict):
+            text = regex.sub(lambda m: repl[m.lastgroup], text)
+        else:
+            text = regex.sub(repl, text)
+    return text
+
+
+# parameters of TextModel used by TextModel.text_transformations
+PREPROCESSING_PARAMS = ['text', 'num_option', 'usr_option', 'url_option', 'emo_option',
+                        'hashtag_option', 'ent_option', 'lc', 'del_dup', 'del_punc',
+                        'del_diac', 'select_ent']
+
+
+class NormalizedText(str):
+    """Text already transformed by :py:func:`TextModel.text_transformations`, the transformations
+    are not applied again (see :py:class:`microtc.cache.CorpusCache`)
+
+    >>> from microtc.textmodel import TextModel, NormalizedText
+    >>> tm = TextModel()
+    >>> tm.tokenize(NormalizedText(tm.text_transformations('Buenos días @mario')))
+    ['buenos', 'dias', '_usr']
+    """
+
+
+# model of the processes created by TextModel.fit and TextModel.transform
+_WORKER_MODEL = None
+
+
+def _worker_init(model):
+    global _WORKER_MODEL
+    _WORKER_MODEL = model
+
+
+def _transform_chunk(texts):
+    return _WORKER_MODEL.transform(texts)
+
+
+def _document_frequency_chunk(texts):
+    return document_frequency(map(_WORKER_MODEL._doc_tokens, texts))
+
+
+class TokenStream(object):
+    """Tokens of a corpus, they are computed each time the corpus is traversed
+
+    :param textmodel: Text model
+    :type textmodel: TextModel
+    :param corpus: Corpus
+    :type corpus: iterable
+    """
+
+    def __init__(self, textmodel, corpus):
+        self._textmodel = textmodel
+        self._corpus = corpus
+
+    def __iter__(self):
+        return map(self._textmodel._doc_tokens, self._corpus)
+
+
 class TextModel:
     """
 
@@ -152,6 +396,12 @@ class TextModel:
 
     :param weighting: Weighting scheme (tfidf | tf | entropy)
     :type weighting: class or str
+    :param hash_size: Number of buckets of the signed feature hashing (None uses a vocabulary)
+    :type hash_size: int
+    :param max_terms: Maximum number of terms, the most frequent (class-aware on entropy) are kept (used in weighting class)
+    :type max_terms: int
+    :param sketch_width: Width of the count-min sketch used to skip the tokens removed by token_min_filter (used in weighting class)
+    :type sketch_width: int
 
     Usage:
 
@@ -189,7 +439,8 @@ class TextModel:
                  ent_option=OPTION_NONE, lc=True, del_dup=True, del_punc=False, del_diac=True,
                  token_list=[-1], token_min_filter=0,
                  token_max_filter=1, select_ent=False, select_suff=False, select_conn=False,
-                 weighting='tfidf', **kwargs):
+                 weighting='tfidf', hash_size=None, max_terms=None,
+                 sketch_width=None, **kwargs):
         self._text = os.getenv('TEXT', default=text)
         self.del_diac = del_diac
         self.num_option = num_option
@@ -210,30 +461,122 @@ class TextModel:
         self.token_max_filter = token_max_filter
         self.weighting = weighting
         self.weighting = WEIGHTING.get(weighting, weighting)
+        self.hash_size = hash_size
+        self.max_terms = max_terms
+        self.sketch_width = sketch_width
 
         if emo_option == OPTION_NONE:
             self.emo_map = None
         else:
-            self.emo_map = EmoticonClassifier()
+            self.emo_map = get_emoticon_classifier()
 
         if docs is not None and len(docs):
             self.fit(docs)
 
-    def fit(self, X):
+    def fit(self, X, n_jobs=1, chunksize=1024):
         """
         Train the model
 
+        :param X: Corpus; when it is not a list, the texts are tokenized while they are
+                  consumed by the weighting scheme and the corpus is not kept in memory.
+                  Schemes such as entropy traverse X twice, so it cannot be an iterator.
+        :type X: iterable
+        :param n_jobs: Number of processes (0 uses all the cores) computing the document
+                       frequencies on chunks of X; the vocabulary is the one of a single process.
+                       It is used by the weighting schemes based on TFIDF with a vocabulary,
+                       i.e., it is ignored when hash_size or max_terms is set.
+        :type n_jobs: int
+        :param chunksize: Number of texts processed at a time by a process
+        :type chunksize: int
+        :rtype: instance
+
+        Example:
+
+        >>> from microtc.textmodel import TextModel
+        >>> corpus = ['buenos dias catedras', 'catedras conacyt']
+        >>> textmodel = TextModel().fit(iter(corpus))
+        >>> textmodel.num_terms
+        4
+        """
+
+        weighting = get_class(self.weighting)
+        if n_jobs != 1 and issubclass(weighting, TFIDF) and not getattr(self, 'hash_size', None) and\
+           not getattr(self, 'max_terms', None):
+            if iter(X) is X and weighting.two_passes:
+                # before the workers tokenize the corpus
+                raise ValueError("%s traverses the corpus twice, X cannot be an iterator" % weighting.__name__)
+            if n_jobs < 1:
+                n_jobs = cpu_count()
+            with Pool(n_jobs, initializer=_worker_init, initargs=(self,)) as pool:
+                # imap keeps the order of the chunks, so the identifiers are the ones of the serial build
+                df = merge_document_frequency(pool.imap(_document_frequency_chunk, chunks(X, chunksize)))
+            tokens = map(self._doc_tokens, X) if iter(X) is X else TokenStream(self, X)
+            self._fit(tokens, X, df=df)
+            return self
+
+        tokens = self._corpus_tokens(X)
+        self._fit(tokens, X)
+        return self
+
+    def partial_fit(self, X):
+        """
+        Updates the model with more texts, e.g., the texts of a new day; the new tokens are
+        appended (see :py:func:`microtc.weighting.TFIDF.partial_fit`). The model is trained
+        with X when it has not been trained.
+
         :param X: Corpus
-        :type X: list
+        :type X: iterable
         :rtype: instance
+
+        Example:
+
+        >>> from microtc.textmodel import TextModel
+        >>> textmodel = TextModel().fit(['buenos dias catedras', 'catedras conacyt'])
+        >>> textmodel = textmodel.partial_fit(['buenas noches'])
+        >>> textmodel.num_terms
+        6
         """
 
-        tokens = [self.tokenize(d) for d in X]
-        self.model = get_class(self.weighting)(tokens, X=X,
-                                               token_min_filter=self.token_min_filter,
-                                               token_max_filter=self.token_max_filter)
+        if getattr(self, 'model', None) is None:
+            return self.fit(X)
+        tokens = self._corpus_tokens(X)
+        self.model.partial_fit(tokens, X=X)
+        self._num_terms = self.model.num_terms
         return self
 
+    def _fit(self, tokens, X, **kwargs):
+        kwargs.update(token_min_filter=self.token_min_filter,
+                      token_max_filter=self.token_max_filter)
+        if getattr(self, 'hash_size', None):
+            kwargs['hash_size'] = self.hash_size
+        if getattr(self, 'max_terms', None):
+            kwargs['max_terms'] = self.max_terms
+        if getattr(self, 'sketch_width', None):
+            kwargs['sketch_width'] = self.sketch_width
+        self.model = get_class(self.weighting)(tokens, X=X, **kwargs)
+        self._num_terms = self.model.num_terms
+
+    def fit_transform(self, X):
+        """
+        Train the model and convert the corpus into vectors; each text is tokenized once
+
+        :param X: Corpus
+        :type X: list
+        :rtype: csr_matrix
+
+        Example:
+
+        >>> from microtc.textmodel import TextModel
+        >>> corpus = ['buenos dias catedras', 'catedras conacyt']
+        >>> X = TextModel().fit_transform(corpus)
+        >>> X.shape
+        (2, 4)
+        """
+
+        tokens = [self._doc_tokens(d) for d in X]
+        self._fit(tokens, X)
+        return self._transform(tokens)
+
     def __getitem__(self, text):
         """Convert text into a vector
 
@@ -242,7 +585,7 @@ class TextModel:
 
         :rtype: list
         """
-        return self.model[self.tokenize(text)]
+        return self.model[self._doc_tokens(text)]
 
     @classmethod
     def params(cls):
@@ -251,7 +594,7 @@ class TextModel:
 
         >>> from microtc.textmodel import TextModel
         >>> TextModel.params()
-        odict_keys(['docs', 'text', 'num_option', 'usr_option', 'url_option', 'emo_option', 'hashtag_option', 'ent_option', 'lc', 'del_dup', 'del_punc', 'del_diac', 'token_list', 'token_min_filter', 'token_max_filter', 'select_ent', 'select_suff', 'select_conn', 'weighting'])
+        odict_keys(['docs', 'text', 'num_option', 'usr_option', 'url_option', 'emo_option', 'hashtag_option', 'ent_option', 'lc', 'del_dup', 'del_punc', 'del_diac', 'token_list', 'token_min_filter', 'token_max_filter', 'select_ent', 'select_suff', 'select_conn', 'weighting', 'hash_size', 'max_terms', 'sketch_width', 'kwargs'])
         """
 
         import inspect
@@ -259,13 +602,17 @@ class TextModel:
         params = sig.parameters.keys()
         return params
 
-    def transform(self, texts):
+    def transform(self, texts, n_jobs=1, chunksize=1024):
         """Convert test into a vector
 
         :param texts: List of text to be transformed
         :type text: list
+        :param n_jobs: Number of processes (0 uses all the cores); the model is sent once to each process
+        :type n_jobs: int
+        :param chunksize: Number of texts transformed at a time by a process
+        :type chunksize: int
 
-        :rtype: list
+        :rtype: csr_matrix
 
         Example:
 
@@ -273,8 +620,35 @@ class TextModel:
         >>> corpus = ['buenos dias catedras', 'catedras conacyt']
         >>> textmodel = TextModel().fit(corpus)
         >>> X = textmodel.transform(corpus)
+        >>> X2 = textmodel.transform(corpus, n_jobs=2, chunksize=1)
+        >>> (X != X2).nnz
+        0
         """
-        return self.tonp([self.__getitem__(x) for x in texts])
+
+        if n_jobs != 1:
+            texts = list(texts)
+        if n_jobs == 1 or len(texts) <= chunksize:
+            return self._transform([self._doc_tokens(x) for x in texts])
+
+        if n_jobs < 1:
+            n_jobs = cpu_count()
+        parts = list(chunks(texts, chunksize))
+        with Pool(min(n_jobs, len(parts)), initializer=_worker_init, initargs=(self,)) as pool:
+            # imap keeps the order of the chunks
+            X = vstack(list(pool.imap(_transform_chunk, parts)), format='csr')
+        if self.num_terms is None:
+            self._num_terms = X.shape[1]
+        return X
+
+    def _transform(self, tokens):
+        transform = getattr(self.model, 'transform', None)
+        if transform is None:
+            # weighting schemes without the batch interface
+            return self.tonp([self.model[t] for t in tokens])
+        X = transform(tokens)
+        if self.num_terms is None:
+            self._num_terms = X.shape[1]
+        return X
 
     def vectorize(self, text):
         raise RuntimeError('Not implemented')
@@ -329,41 +703,35 @@ class TextModel:
         if isinstance(text, dict):
             text = self.get_text(text)
 
+        if isinstance(text, NormalizedText):
+            return text
+
         if self.emo_map:
             text = self.emo_map.replace(text, option=self.emo_option)
 
         if self.select_ent:
             text = " ".join(re.findall(r"(@\S+|#\S+|[A-Z]\S+)", text))
 
-        if self.hashtag_option == OPTION_DELETE:
-            text = re.sub(r"#\S+", "", text)
-        elif self.hashtag_option == OPTION_GROUP:
-            text = re.sub(r"#\S+", "_htag", text)
-
-        if self.ent_option == OPTION_DELETE:
-            text = re.sub(r"[A-Z][a-z]+", "", text)
-        elif self.ent_option == OPTION_GROUP:
-            text = re.sub(r"[A-Z][a-z]+", "_ent", text)
+        plan = get_transformation_plan(self.hashtag_option, self.ent_option, self.lc,
+                                       self.num_option, self.url_option, self.usr_option)
+        text = apply_transformation_plan(plan, text)
 
-        if self.lc:
-            text = text.lower()
+        return norm_chars(text, del_diac=self.del_diac, del_dup=self.del_dup, del_punc=self.del_punc)
 
-        if self.num_option == OPTION_DELETE:
-            text = re.sub(r"\d+\.?\d+", "", text)
-        elif self.num_option == OPTION_GROUP:
-            text = re.sub(r"\d+\.?\d+", "_num", text)
+    def preprocessing_params(self):
+        """Parameters used by :py:func:`TextModel.text_transformations`, two models having
+        the same ones produce the same normalized texts
 
-        if self.url_option == OPTION_DELETE:
-            text = re.sub(r"https?://\S+", "", text)
-        elif self.url_option == OPTION_GROUP:
-            text = re.sub(r"https?://\S+", "_url", text)
+        >>> from microtc.textmodel import TextModel
+        >>> TextModel(token_list=[3]).preprocessing_params() == TextModel(token_list=[-1]).preprocessing_params()
+        True
 
-        if self.usr_option == OPTION_DELETE:
-            text = re.sub(r"@\S+", "", text)
-        elif self.usr_option == OPTION_GROUP:
-            text = re.sub(r"@\S+", "_usr", text)
+        :rtype: dict
+        """
 
-        return norm_chars(text, del_diac=self.del_diac, del_dup=self.del_dup, del_punc=self.del_punc)
+        output = {k: getattr(self, k, None) for k in PREPROCESSING_PARAMS if k != 'text'}
+        output['text'] = self._text
+        return output
 
     def compute_tokens(self, text):
         """
@@ -398,6 +766,35 @@ class TextModel:
 
         return L
 
+    def compute_token_hashes(self, text):
+        """Hashes of the tokens computed by :py:func:`TextModel.compute_tokens`
+
+        :param text:
+        :type text: str
+
+        :rtype: list
+        """
+
+        qsizes = [q for q in self.token_list if isinstance(q, int) and q > 0]
+        if len(qsizes):
+            qgrams = expand_qgram_hashes(encode_text(text), qsizes, dict())
+        words = None
+        L = []
+        for q in self.token_list:
+            if isinstance(q, int) and q > 0:
+                L.append(qgrams[q])
+                continue
+            if words is None:
+                words = get_word_list(text)
+                lengths = np.fromiter(map(len, words), dtype=np.int64, count=len(words))
+                words = hash_tokens(words)
+            if isinstance(q, int):
+                L.append(expand_qgram_hashes_word_list(words, lengths, abs(q)))
+            else:
+                L.append(expand_skipgram_hashes_word_list(words, lengths, q))
+
+        return L
+
     def select_tokens(self, L):
         """
         :param L: list of tokens
@@ -424,6 +821,66 @@ class TextModel:
 
         return L
 
+    def tokenize_ids(self, text, reverse=None):
+        """Transform text to the hashes of its tokens, the tokens are not built
+        (see :py:class:`microtc.weighting.HashingVocabulary`)
+
+        :param text: Text
+        :type text: str or list
+        :param reverse: Map from hash to token, it is updated with the tokens of the text (for debugging)
+        :type reverse: dict
+
+        :rtype: np.array
+
+        Example:
+
+        >>> from microtc.textmodel import TextModel
+        >>> tm = TextModel(token_list=[-1, 3])
+        >>> reverse = dict()
+        >>> h = tm.tokenize_ids("buenos dias", reverse=reverse)
+        >>> [reverse[x] for x in h.tolist()][:4]
+        ['buenos', 'dias', '~bu', 'bue']
+        """
+
+        if isinstance(text, (list, tuple)):
+            L = [self.tokenize_ids(_text, reverse=reverse) for _text in text]
+            if len(L) == 0:
+                return hash_tokens([])
+            return np.concatenate(L)
+
+        if reverse is not None:
+            tokens = self._tokenize(text)
+            h = hash_tokens(tokens)
+            reverse.update(zip(h.tolist(), tokens))
+            return h
+        text = self.text_transformations(text)
+        if self.select_suff or self.select_conn:
+            L = []
+            for _ in self.compute_tokens(text):
+                L += _
+            L = self.select_tokens(L)
+            h = hash_tokens(L)
+        else:
+            h = np.concatenate(self.compute_token_hashes(text))
+        if h.shape[0] == 0:
+            h = hash_tokens(['~'])
+
+        return h
+
+    def _corpus_tokens(self, X):
+        # lists are tokenized at once, other iterables each time they are traversed
+        if isinstance(X, list):
+            return [self._doc_tokens(d) for d in X]
+        if iter(X) is X:
+            return map(self._doc_tokens, X)
+        return TokenStream(self, X)
+
+    def _doc_tokens(self, text):
+        # integer tokens are only consumed by the feature hashing
+        if getattr(self, 'hash_size', None):
+            return self.tokenize_ids(text)
+        return self.tokenize(text)
+
     @property
     def num_terms(self):
         """Dimension which is the number of terms of the corpus
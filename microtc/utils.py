@@ -12,13 +12,21 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import io
 import os
-import json
+import sys
 import gzip
+import stat
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
 
 def line_iterator(filename):
-    if filename.endswith(".gz"):
+    if filename == '-':
+        f = sys.stdin
+    elif filename.endswith(".gz"):
         f = gzip.GzipFile(filename)
     else:
         f = open(filename, encoding='utf8')
@@ -41,12 +49,76 @@ def line_iterator(filename):
         yield line
 
     # Close the file...
-    f.close()
+    if f is not sys.stdin:
+        f.close()
+
+
+def json_blocks(filename, blocksize=1 << 22):
+    """Decodes a JSON-lines file in blocks of about `blocksize` bytes, i.e., the lines are
+    read at once and each one is decoded (orjson when it is installed). The standard input
+    and the pipes are read as the data arrives, so the first lines are decoded at once.
+
+    :param filename: File name, it can be gzipped or '-' for the standard input
+    :type filename: str
+    :param blocksize: Number of bytes read at once
+    :type blocksize: int
+    :rtype: generator of lists
+    """
+
+    if filename == '-':
+        f = sys.stdin.buffer
+    elif filename.endswith(".gz"):
+        f = gzip.GzipFile(filename)
+    else:
+        f = open(filename, 'rb')
+
+    try:
+        regular = stat.S_ISREG(os.fstat(f.fileno()).st_mode)
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        regular = False
+    # read1 does not wait for blocksize bytes
+    read = f.read if regular else f.read1
+    rest = b''
+    lineno = 1
+    try:
+        while True:
+            data = read(blocksize)
+            if len(data) == 0:
+                break
+            data = rest + data
+            cut = data.rfind(b'\n')
+            if cut < 0:
+                rest = data
+                continue
+            rest = data[cut + 1:]
+            block = _decode_block(data[:cut], filename, lineno)
+            lineno += data.count(b'\n', 0, cut) + 1
+            if len(block):
+                yield block
+        block = _decode_block(rest, filename, lineno)
+        if len(block):
+            yield block
+    finally:
+        if f is not sys.stdin.buffer:
+            f.close()
+
+
+def _decode_block(data, filename, lineno):
+    output = []
+    for i, line in enumerate(data.split(b'\n')):
+        if len(line.strip()) == 0:
+            continue
+        try:
+            output.append(json_loads(line))
+        except ValueError as e:
+            raise ValueError("%s, line %d: %s" % (filename, lineno + i, e)) from e
+    return output
 
 
 def tweet_iterator(filename):
-    for line in line_iterator(filename):
-        yield json.loads(line)
+    for block in json_blocks(filename):
+        for tweet in block:
+            yield tweet
 
 
 TEXT = os.environ.get("TEXT", 'text')
@@ -104,6 +176,36 @@ def read_data(filename, get_tweet=TEXT, maxitems=1e100):
     return data
 
 
+def read_corpus(filename, get_label=KLASS, label_type=str, maxitems=1e100):
+    """Reads a file once and returns its tweets and the column of their labels
+
+    :param filename: File name
+    :type filename: str
+    :param get_label: Key of the label (or a function)
+    :type get_label: str or function
+    :param label_type: Type of the label, e.g., str on classification and float on regression
+    :type label_type: type
+    :rtype: tuple
+
+    >>> import os
+    >>> from microtc.utils import read_corpus
+    >>> tweets, labels = read_corpus(os.path.join(os.path.dirname(__file__), 'tests', 'text.json'))
+    >>> len(tweets) == len(labels), labels[0]
+    (True, 'POS')
+    """
+
+    tweets, labels = [], []
+    for block in json_blocks(filename):
+        if len(tweets) + len(block) > maxitems:
+            block = block[:int(maxitems) - len(tweets)]
+        tweets.extend(block)
+        labels.extend([label_type(get_label(x) if callable(get_label) else x[get_label]) for x in block])
+        if len(tweets) >= maxitems:
+            break
+
+    return tweets, labels
+
+
 def get_class(m):
     """Import class from string
 
@@ -123,30 +225,97 @@ def get_class(m):
     return m
 
 
-def load_model(fname):
-    """Read model from file. The model must be stored using gzip and pickle
+# file format of save_model
+MODEL_MAGIC = b'MICROTC\x00'
+MODEL_VERSION = 1
+MODEL_ALIGNMENT = 64
+
+
+def _align(pos):
+    return (pos + MODEL_ALIGNMENT - 1) // MODEL_ALIGNMENT * MODEL_ALIGNMENT
+
+
+def load_model(fname, mmap=True):
+    """Read model from file. The file is mapped in memory and the arrays (weights, vocabulary,
+    coefficients) use its pages, so loading does not read them and the processes
+    using the same model share them. The map, and with it the file, is closed when the
+    last array using it is released; the file cannot be removed or replaced on Windows
+    while the model is in use, mmap=False reads the file and closes it at once.
+    Models stored with gzip and pickle are also read.
 
     :param fname: filename
     :type fname: str (path)
+    :param mmap: Map the file in memory
+    :type mmap: bool
     """
     import gzip
+    import mmap as _mmap
     import pickle
-    with gzip.open(fname, 'r') as fpt:
-        _ = pickle.load(fpt)
-    return _
+    import struct
+    with open(fname, 'rb') as fpt:
+        magic = fpt.read(len(MODEL_MAGIC))
+        if magic == MODEL_MAGIC:
+            version, nbuffers = struct.unpack('<QQ', fpt.read(16))
+            if version > MODEL_VERSION:
+                raise RuntimeError("Unsupported model version %d" % version)
+            table = struct.unpack('<%dQ' % (2 * nbuffers + 2), fpt.read(16 * nbuffers + 16))
+            if mmap:
+                # copy on write, the pages are shared until an array is modified
+                data = _mmap.mmap(fpt.fileno(), 0, access=_mmap.ACCESS_COPY)
+            else:
+                data = bytearray(os.fstat(fpt.fileno()).st_size)
+                fpt.seek(0)
+                fpt.readinto(data)
+
+    if magic != MODEL_MAGIC:
+        with gzip.open(fname, 'r') as fpt:
+            _ = pickle.load(fpt)
+        return _
+
+    with memoryview(data) as view:
+        buffers = [view[offset:offset + size] for offset, size in zip(table[0:-2:2], table[1:-2:2])]
+        offset, size = table[-2:]
+        output = pickle.loads(view[offset:offset + size], buffers=buffers)
+        # only the arrays keep the map
+        [b.release() for b in buffers]
+    return output
 
 
 def save_model(obj, fname):
-    """Store model from file. The model is stored using gzip and pickle
+    """Store model in a file. The model is pickled (protocol 5) and the buffers of its arrays
+    are written aligned to 64 bytes out of the pickle, see :py:func:`load_model`.
+
+    The layout (little endian) is: magic (8 bytes), version and number of buffers n (uint64),
+    offset and size of each buffer and of the pickle (uint64), the buffers, and the pickle.
 
     :param obj: object to store
     :type obj: object
     :param fname: filename
     :type fname: str (path)
     """
-    
-    import gzip
-    import pickle
-    with gzip.open(fname, 'w') as fpt:
-        pickle.dump(obj, fpt)
 
+    import pickle
+    import struct
+    buffers = []
+    data = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+    buffers = [b.raw() for b in buffers] + [memoryview(data)]
+    table = []
+    pos = _align(len(MODEL_MAGIC) + 16 + 16 * len(buffers))
+    for b in buffers:
+        table.extend([pos, b.nbytes])
+        pos = _align(pos + b.nbytes)
+    # the model is written aside and then renamed, a model being mapped from fname is not truncated
+    tmp = '%s.%d.tmp' % (fname, os.getpid())
+    try:
+        with open(tmp, 'wb') as fpt:
+            fpt.write(MODEL_MAGIC)
+            fpt.write(struct.pack('<QQ', MODEL_VERSION, len(buffers) - 1))
+            fpt.write(struct.pack('<%dQ' % len(table), *table))
+            for offset, b in zip(table[::2], buffers):
+                fpt.write(b'\x00' * (offset - fpt.tell()))
+                fpt.write(b)
+        os.replace(tmp, fname)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
@@ -15,7 +15,501 @@
 
 import numpy as np
 from .utils import KLASS 
-from collections import Counter
+from collections import Counter, defaultdict
+from itertools import islice
+from scipy.sparse import csr_matrix
+
+
+class Vocabulary(object):
+    """
+    Compact map from token to identifier. The tokens are stored (UTF-8) in sorted
+    fixed-width arrays, one per length, so there is no padding and a batch of
+    tokens is looked up with binary searches.
+
+    :param word2id: Map token to identifier
+    :type word2id: dict
+
+    Usage:
+
+    >>> from microtc.weighting import Vocabulary
+    >>> voc = Vocabulary(dict(buenos=0, dias=1, microtc=2))
+    >>> voc['dias']
+    1
+    >>> voc.lookup(['microtc', 'X', 'buenos'])
+    array([ 2, -1,  0])
+    """
+
+    def __init__(self, word2id):
+        self._tokens = {}
+        self._ids = {}
+        self._size = 0
+        self._add(word2id.items())
+
+    def _add(self, items):
+        groups = defaultdict(list)
+        for token, ident in items:
+            token = token.encode('utf-8')
+            groups[len(token)].append((token, ident))
+
+        for size, lst in groups.items():
+            tokens = np.array([x[0] for x in lst], dtype='S%d' % max(size, 1))
+            ids = np.array([x[1] for x in lst], dtype=np.int32)
+            if size in self._tokens:
+                tokens = np.concatenate([self._tokens[size], tokens])
+                ids = np.concatenate([self._ids[size], ids])
+            order = np.argsort(tokens, kind='stable')
+            self._tokens[size] = tokens[order]
+            self._ids[size] = ids[order]
+            self._size += len(lst)
+
+    def extend(self, tokens):
+        """Appends the unknown tokens; their identifiers follow the last one
+
+        :param tokens: list of tokens
+        :type tokens: list
+
+        >>> from microtc.weighting import Vocabulary
+        >>> voc = Vocabulary(dict(buenos=0, dias=1))
+        >>> voc.extend(['dias', 'tardes', 'noches', 'tardes'])
+        >>> voc.lookup(['buenos', 'tardes', 'noches'])
+        array([0, 2, 3])
+        """
+
+        tokens = [t for t, ident in zip(tokens, self.lookup(tokens)) if ident < 0]
+        tokens = list(dict.fromkeys(tokens))
+        self._add(zip(tokens, range(self._size, self._size + len(tokens))))
+
+    def take(self, ids):
+        """Vocabulary of the tokens whose identifiers are in `ids`, the token ids[i] gets the
+        identifier i; the tables are filtered, so the tokens are not sorted again
+
+        :param ids: Identifiers of the tokens kept
+        :type ids: np.array
+        :rtype: Vocabulary
+
+        >>> from microtc.weighting import Vocabulary
+        >>> voc = Vocabulary(dict(buenos=0, dias=1, microtc=2)).take([2, 0])
+        >>> voc.lookup(['buenos', 'dias', 'microtc'])
+        array([ 1, -1,  0])
+        """
+
+        ident = np.full(self._size, -1, dtype=np.int64)
+        ident[ids] = np.arange(len(ids))
+        output = Vocabulary({})
+        for size, table in self._tokens.items():
+            new = ident[self._ids[size]]
+            mask = new >= 0
+            if mask.any():
+                output._tokens[size] = table[mask]
+                output._ids[size] = new[mask].astype(np.int32)
+        output._size = len(ids)
+        return output
+
+    def __len__(self):
+        return self._size
+
+    def lookup(self, tokens, sign=False):
+        """Identifiers of a list of tokens, -1 is used for unknown tokens
+
+        :param tokens: list of tokens
+        :type tokens: list
+        :param sign: Also return the sign of each token (None, i.e., all positive)
+        :type sign: bool
+        :rtype: np.array
+        """
+
+        ids = np.full(len(tokens), -1, dtype=np.int64)
+        if sign:
+            return self.lookup(tokens), None
+        if len(tokens) == 0:
+            return ids
+        groups = defaultdict(list)
+        for i, token in enumerate(map(str.encode, tokens)):
+            groups[len(token)].append((i, token))
+        for size, lst in groups.items():
+            table = self._tokens.get(size)
+            if table is None:
+                continue
+            # the queries have the width of their group, a long token does not pad the others
+            index = np.array([x[0] for x in lst], dtype=np.int64)
+            query = np.array([x[1] for x in lst], dtype=table.dtype)
+            pos = np.minimum(np.searchsorted(table, query), table.shape[0] - 1)
+            found = table[pos] == query
+            ids[index[found]] = self._ids[size][pos[found]]
+        return ids
+
+    def get(self, token, default=None):
+        ident = self.lookup([token])[0]
+        if ident < 0:
+            return default
+        return int(ident)
+
+    def __getitem__(self, token):
+        ident = self.get(token)
+        if ident is None:
+            raise KeyError(token)
+        return ident
+
+    def __contains__(self, token):
+        return self.get(token) is not None
+
+    def items(self):
+        """Pairs (token, identifier) sorted by identifier"""
+
+        lst = []
+        for size, table in self._tokens.items():
+            # bytes are read from the buffer, numpy strips trailing zeros
+            tokens = table.view(np.uint8).reshape(table.shape[0], -1)[:, :size]
+            lst.extend(zip([x.tobytes().decode('utf-8') for x in tokens], self._ids[size].tolist()))
+        lst.sort(key=lambda x: x[1])
+        return lst
+
+    def keys(self):
+        return [k for k, _ in self.items()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+
+# base of the polynomial hash (64 bits FNV prime)
+HASH_BASE = np.uint64(1099511628211)
+HASH_SEP = np.uint64(ord('~'))
+
+
+def hash_tokens(tokens):
+    """Polynomial hash modulo 2**64 of the code points of each token, i.e.,
+    h(t) = t[0] B**(n-1) + ... + t[n-1]. The hash of a concatenation is computed
+    from the hashes of its parts, h(xy) = h(x) B**len(y) + h(y), which is how the
+    integer tokenizer of :py:class:`microtc.textmodel.TextModel` obtains the same
+    values without building the tokens.
+
+    :param tokens: list of tokens
+    :type tokens: list
+    :rtype: np.array
+    """
+
+    n = len(tokens)
+    output = np.zeros(n, dtype=np.uint64)
+    if n == 0:
+        return output
+    lengths = np.fromiter(map(len, tokens), dtype=np.int64, count=n)
+    # the tokens are grouped by length, a long token does not pad the others
+    order = np.argsort(lengths, kind='stable')
+    codes = np.frombuffer("".join([tokens[i] for i in order]).encode('utf-32-le', 'surrogatepass'),
+                          dtype=np.uint32).astype(np.uint64)
+    sizes, counts = np.unique(lengths[order], return_counts=True)
+    start = pos = 0
+    for size, count in zip(sizes.tolist(), counts.tolist()):
+        M = codes[pos:pos + size * count].reshape(count, size)
+        output[order[start:start + count]] = M.dot(np.power(HASH_BASE, np.arange(size - 1, -1, -1, dtype=np.uint64)))
+        start += count
+        pos += size * count
+    return output
+
+
+def hash_concat(h1, h2, length):
+    """Hash of the concatenation `x~y` given the hashes of `x` and `y`, and the length of `y`"""
+
+    p = np.power(HASH_BASE, length.astype(np.uint64))
+    return (h1 * HASH_BASE + HASH_SEP) * p + h2
+
+
+class HashingVocabulary(object):
+    """
+    Maps tokens to a fixed number of buckets with a stable signed hash, the polynomial
+    hash of :py:func:`hash_tokens` followed by a bit mixer; the value modulo the number
+    of buckets is the bucket and the highest bit the sign. The tokens can also be given
+    as an array with their hashes. The buckets removed by the filters are marked in `mask`.
+
+    :param size: Number of buckets
+    :type size: int
+
+    Usage:
+
+    >>> from microtc.weighting import HashingVocabulary
+    >>> voc = HashingVocabulary(16)
+    >>> voc.lookup(['buenos', 'dias'])
+    array([10,  2])
+    """
+
+    def __init__(self, size):
+        self._size = int(size)
+        self.mask = None
+
+    def __len__(self):
+        return self._size
+
+    @staticmethod
+    def mix(h):
+        """Finalizer of splitmix64"""
+
+        h = h ^ (h >> np.uint64(30))
+        h = h * np.uint64(0xbf58476d1ce4e5b9)
+        h = h ^ (h >> np.uint64(27))
+        h = h * np.uint64(0x94d049bb133111eb)
+        return h ^ (h >> np.uint64(31))
+
+    def lookup(self, tokens, sign=False):
+        """Bucket of a list of tokens, -1 is used for the buckets removed
+
+        :param tokens: list of tokens or array of hashes
+        :type tokens: list or np.array
+        :param sign: Also return the sign of each token
+        :type sign: bool
+        :rtype: np.array
+        """
+
+        if not isinstance(tokens, np.ndarray):
+            tokens = hash_tokens(tokens)
+        h = self.mix(tokens)
+        ids = (h % np.uint64(self._size)).astype(np.int64)
+        if self.mask is not None:
+            ids[~self.mask[ids]] = -1
+        if sign:
+            return ids, np.where(h >> np.uint64(63), -1.0, 1.0)
+        return ids
+
+    def get(self, token, default=None):
+        ident = self.lookup([token])[0]
+        if ident < 0:
+            return default
+        return int(ident)
+
+    def __getitem__(self, token):
+        ident = self.get(token)
+        if ident is None:
+            raise KeyError(token)
+        return ident
+
+    def __contains__(self, token):
+        return self.get(token) is not None
+
+
+def flatten(docs):
+    """Tokens of a list of documents and the document of each token
+
+    :param docs: list of list of tokens, or of arrays of hashes
+    :type docs: list
+    :rtype: tuple
+    """
+
+    rows = np.repeat(np.arange(len(docs)), [len(tokens) for tokens in docs])
+    if len(docs) and isinstance(docs[0], np.ndarray):
+        return np.concatenate(docs), rows
+    return [token for tokens in docs for token in tokens], rows
+
+
+def document_frequency(docs):
+    """Number of documents containing each token; the identifiers follow the order in which
+    the tokens appear
+
+    :param docs: corpus as a list of list of tokens
+    :type docs: iterable
+    :rtype: tuple - map from token to identifier, frequencies, and number of documents
+
+    >>> from microtc.weighting import document_frequency
+    >>> document_frequency([['a', 'b', 'a'], ['b', 'c']])
+    ({'a': 0, 'b': 1, 'c': 2}, array([1, 2, 1]), 2)
+    """
+
+    w2id = {}
+    weight = []
+    ndocs = 0
+    for tokens in docs:
+        ndocs += 1
+        for x, freq in Counter(tokens).items():
+            try:
+                ident = w2id[x]
+                weight[ident] = weight[ident] + 1
+            except KeyError:
+                ident = len(w2id)
+                w2id[x] = ident
+                weight.append(1)
+    return w2id, np.array(weight, dtype=np.int64), ndocs
+
+
+def merge_document_frequency(parts):
+    """Merges the output of :py:func:`document_frequency` on consecutive shards of a corpus;
+    the identifiers are the ones obtained on the whole corpus
+
+    :param parts: document frequencies of the shards in the order of the corpus
+    :type parts: iterable
+    :rtype: tuple
+
+    >>> from microtc.weighting import document_frequency, merge_document_frequency
+    >>> docs = [['a', 'b', 'a'], ['b', 'c'], ['d', 'a']]
+    >>> merge_document_frequency([document_frequency(docs[:2]), document_frequency(docs[2:])])
+    ({'a': 0, 'b': 1, 'c': 2, 'd': 3}, array([2, 2, 1, 1]), 3)
+    """
+
+    w2id = {}
+    weight = []
+    ndocs = 0
+    for _w2id, _weight, _ndocs in parts:
+        ndocs += _ndocs
+        _weight = _weight.tolist()
+        # the tokens of a shard are in the order of their identifiers
+        for x, i in _w2id.items():
+            try:
+                ident = w2id[x]
+                weight[ident] = weight[ident] + _weight[i]
+            except KeyError:
+                w2id[x] = len(w2id)
+                weight.append(_weight[i])
+    return w2id, np.array(weight, dtype=np.int64), ndocs
+
+
+def heavy_hitters(docs, size):
+    """Document frequency of the most frequent tokens with at most `2 * size` counters.
+    It is Space-Saving applied in batches: when the table is full the `size` most
+    frequent tokens are kept, and a new token starts with the largest count removed,
+    i.e., the frequencies are overestimated by at most that count.
+
+    :param docs: corpus as a list of list of tokens
+    :type docs: iterable
+    :param size: Number of tokens
+    :type size: int
+    :rtype: tuple - tokens, frequencies, and number of documents
+
+    >>> from microtc.weighting import heavy_hitters
+    >>> docs = [['a', 'b'], ['a', 'c'], ['a', 'b', 'd'], ['e']]
+    >>> tokens, df, ndocs = heavy_hitters(docs, 2)
+    >>> dict(zip(tokens, df))['a']
+    3
+    """
+
+    counter = dict()
+    floor = 0
+    ndocs = 0
+    for tokens in docs:
+        ndocs += 1
+        for token in dict.fromkeys(tokens):
+            try:
+                counter[token] += 1
+            except KeyError:
+                counter[token] = floor + 1
+        if len(counter) >= 2 * size:
+            keys = list(counter.keys())
+            values = np.fromiter(counter.values(), dtype=np.int64, count=len(keys))
+            order = np.argsort(-values, kind='stable')
+            floor = max(floor, values[order[size]])
+            counter = {keys[i]: values[i] for i in np.sort(order[:size])}
+    keys = np.empty(len(counter), dtype=object)
+    keys[:] = list(counter.keys())
+    return keys, np.fromiter(counter.values(), dtype=np.int64, count=len(keys)), ndocs
+
+
+class CountMinSketch(object):
+    """
+    Count-min sketch of the document frequency of the tokens. The estimate never
+    underestimates the frequency and, with probability at least 1 - exp(-depth),
+    it overestimates it by at most e / width times the number of pairs
+    (document, token), i.e., rare tokens are discarded exactly and only some
+    extra tokens are admitted.
+
+    :param width: Number of counters per row
+    :type width: int
+    :param depth: Number of rows, i.e., of hash functions
+    :type depth: int
+
+    Usage:
+
+    >>> from microtc.weighting import CountMinSketch
+    >>> docs = [['a', 'b', 'a'], ['a', 'c'], ['b', 'a']]
+    >>> sketch = CountMinSketch(1024)
+    >>> sketch.fit(docs)
+    3
+    >>> sketch.estimate(['a', 'b', 'c', 'd'])
+    array([3, 2, 1, 0], dtype=int32)
+    """
+
+    SEEDS = [0x9e3779b97f4a7c15, 0xc2b2ae3d27d4eb4f, 0x165667b19e3779f9, 0x27d4eb2f165667c5,
+             0x85ebca6b0f1bbcdc, 0xcc9e2d51a54ff53a, 0x1b873593e6546b64, 0xe6546b64cc9e2d51]
+
+    def __init__(self, width, depth=4):
+        assert depth <= len(self.SEEDS)
+        self.table = np.zeros((depth, int(width)), dtype=np.int32)
+
+    def index(self, tokens):
+        """Counter of each token per row
+
+        :param tokens: list of tokens or array of hashes
+        :type tokens: list or np.array
+        :rtype: np.array
+        """
+
+        if not isinstance(tokens, np.ndarray):
+            tokens = hash_tokens(tokens)
+        width = np.uint64(self.table.shape[1])
+        return np.array([HashingVocabulary.mix(tokens ^ np.uint64(seed)) % width
+                         for seed in self.SEEDS[:self.table.shape[0]]], dtype=np.int64)
+
+    def fit(self, docs):
+        """Adds the documents, a token is counted once per document
+
+        :param docs: corpus as a list of list of tokens
+        :type docs: iterable
+        :rtype: int - number of documents
+        """
+
+        ndocs = 0
+        for chunk in chunks(docs):
+            tokens, rows = flatten(chunk)
+            if not isinstance(tokens, np.ndarray):
+                tokens = hash_tokens(tokens)
+            order = np.lexsort((tokens, rows))
+            rows, tokens = rows[order], tokens[order]
+            first = np.ones(rows.shape[0], dtype=bool)
+            first[1:] = (rows[1:] != rows[:-1]) | (tokens[1:] != tokens[:-1])
+            for row, col in zip(self.table, self.index(tokens[first])):
+                np.add.at(row, col, 1)
+            ndocs += len(chunk)
+        return ndocs
+
+    def estimate(self, tokens):
+        """Estimated number of documents containing each token
+
+        :param tokens: list of tokens or array of hashes
+        :type tokens: list or np.array
+        :rtype: np.array
+        """
+
+        index = self.index(tokens)
+        return np.min([row[col] for row, col in zip(self.table, index)], axis=0).astype(np.int32)
+
+    def select(self, docs, min_frequency):
+        """Traverses docs keeping the tokens whose estimate is higher than min_frequency
+
+        :param docs: corpus as a list of list of tokens
+        :type docs: iterable
+        :param min_frequency: Number of documents
+        :type min_frequency: int
+        :rtype: generator
+        """
+
+        for chunk in chunks(docs):
+            tokens, rows = flatten(chunk)
+            admit = self.estimate(tokens) > min_frequency
+            start = 0
+            for doc in chunk:
+                end = start + len(doc)
+                yield [token for token, x in zip(doc, admit[start:end]) if x]
+                start = end
+
+
+def chunks(docs, size=1024):
+    """Traverses an iterable in lists of `size` elements
+
+    :param docs: iterable
+    :rtype: generator
+    """
+
+    docs = iter(docs)
+    while True:
+        chunk = list(islice(docs, size))
+        if len(chunk) == 0:
+            break
+        yield chunk
 
 
 class TFIDF(object):
@@ -31,6 +525,18 @@ class TFIDF(object):
 
     :param token_max_filter: Keep those tokens that appear less times than the parameter
     :type token_max_filter: int or float
+    :param hash_size: Number of buckets of the feature hashing (see :py:class:`HashingVocabulary`)
+    :type hash_size: int
+    :param max_terms: Maximum number of terms; the document frequencies are estimated with
+                      :py:func:`heavy_hitters` so the whole vocabulary is not kept in memory
+    :type max_terms: int
+    :param sketch_width: Width of a :py:class:`CountMinSketch` filled in a first pass over docs;
+                         the tokens that cannot pass token_min_filter are not counted in the
+                         second pass. The vocabulary is the same, docs must be traversed twice.
+    :type sketch_width: int
+    :param df: Output of :py:func:`document_frequency` computed elsewhere, e.g., on shards of
+               the corpus merged with :py:func:`merge_document_frequency`; docs is not traversed
+    :type df: tuple
 
     Usage:
 
@@ -39,37 +545,207 @@ class TFIDF(object):
     >>> tfidf = TFIDF(tokens)
     >>> vector = tfidf['buenos', 'X', 'trafico']
     """
+    # docs is traversed once when the document frequencies are given
+    two_passes = False
+
+    def __init__(self, docs, X=None, token_min_filter=0, token_max_filter=1, hash_size=None,
+                 max_terms=None, sketch_width=None, df=None):
+        # docs is traversed once, it can be any iterable
+        self._ndocs = 0
+        if hash_size:
+            w2id = HashingVocabulary(hash_size)
+            weight = np.zeros(hash_size, dtype=np.int64)
+            for chunk in chunks(docs):
+                tokens, rows = flatten(chunk)
+                ids = w2id.lookup(tokens)
+                key = np.unique(rows * hash_size + ids)
+                weight += np.bincount(key % hash_size, minlength=hash_size)
+                self._ndocs += len(chunk)
+            w2id.mask = (weight > 0) & self.filter(weight, token_min_filter, token_max_filter)
+        elif max_terms:
+            w2id, weight, self._ndocs = heavy_hitters(docs, max_terms)
+            mask = self.filter(weight, token_min_filter, token_max_filter)
+            w2id = {k: i for i, k in enumerate(w2id[mask])}
+            weight = weight[mask]
+        else:
+            stream = docs
+            if df is None and sketch_width and self.min_frequency(token_min_filter, token_max_filter):
+                if iter(docs) is docs:
+                    raise ValueError("The sketch traverses the corpus twice, docs cannot be an iterator")
+                sketch = CountMinSketch(sketch_width)
+                self._ndocs = sketch.fit(docs)
+                stream = sketch.select(docs, self.min_frequency(token_min_filter, token_max_filter))
+                self._ndocs = 0
+            if df is None:
+                df = document_frequency(stream)
+            w2id, weight, self._ndocs = df
+            mask = self.filter(weight, token_min_filter, token_max_filter)
+            if not mask.all():
+                ident = np.cumsum(mask) - 1
+                w2id = {k: int(ident[v]) for k, v in w2id.items() if mask[v]}
+                weight = weight[mask]
+        self.word2id = w2id
+        # the document frequencies, the filters, and the cap are kept to update the model (see partial_fit)
+        self._df = np.asarray(weight, dtype=np.int32)
+        self._filters = (token_min_filter, token_max_filter)
+        self._max_terms = max_terms
+        if max_terms and self.active_terms().sum() > max_terms:
+            self.select(docs, X, max_terms)
+        self.wordWeight = self._df
+
+    def select(self, docs, X, max_terms):
+        """Keeps the `max_terms` tokens with the highest document frequency
+
+        :param docs: corpus as a list of list of tokens
+        :type docs: iterable
+        :param X: original corpus
+        :type X: iterable
+        :param max_terms: Number of tokens
+        :type max_terms: int
+        """
+
+        self.keep(self.top(self._df, max_terms))
+
+    def active_terms(self):
+        """Mask of the identifiers in use, the buckets removed by the filters are not used on feature hashing"""
+
+        if isinstance(self._w2id, HashingVocabulary):
+            return self._w2id.mask
+        return np.ones(self.num_terms, dtype=bool)
+
+    def top(self, score, k):
+        """Identifiers, in increasing order, of the `k` terms in use with the highest score"""
+
+        score = np.where(self.active_terms(), score, -np.inf)
+        return np.sort(np.argsort(-score, kind='stable')[:k])
+
+    def keep(self, ids):
+        """Removes the tokens not in `ids`, the identifiers are assigned in the order of `ids`
+
+        :param ids: Identifiers of the tokens kept
+        :type ids: np.array
+        """
+
+        w2id = self._w2id
+        if isinstance(w2id, HashingVocabulary):
+            mask = np.zeros(len(w2id), dtype=bool)
+            mask[ids] = True
+            w2id.mask &= mask
+            return
+        self.word2id = w2id.take(ids)
+        self._df = self._df[ids]
+
+    def partial_fit(self, docs, X=None):
+        """Updates the model with more documents; the document frequencies and the number
+        of documents are updated, the new tokens that pass the filters on the frequency are
+        appended to the vocabulary, and the weights are computed again when they are used.
+        The terms of the model are not filtered again, but when the number of terms is capped
+        (max_terms) the terms are selected again (see :py:func:`TFIDF.select`).
+
+        :param docs: corpus as a list of list of tokens
+        :type docs: iterable
+        :param X: original corpus useful to pass extra information in a dict
+        :type X: iterable
+        :rtype: self
+        """
+
+        if getattr(self, '_df', None) is None:
+            raise RuntimeError("The model does not keep the document frequencies, it must be trained again")
+        self._update(docs, X)
+        max_terms = getattr(self, '_max_terms', None)
+        if max_terms and self.active_terms().sum() > max_terms:
+            self.keep(self.top(self.score(), max_terms))
+        return self
+
+    def _update(self, docs, X):
+        # document frequencies of partial_fit
+        token_min_filter, token_max_filter = getattr(self, '_filters', (0, 1))
+        w2id = self._w2id
+        if isinstance(w2id, HashingVocabulary):
+            df = np.zeros(len(w2id), dtype=np.int32)
+            voc = HashingVocabulary(len(w2id))
+            for chunk in chunks(docs):
+                tokens, rows = flatten(chunk)
+                key = np.unique(rows * len(w2id) + voc.lookup(tokens))
+                df += np.bincount(key % len(w2id), minlength=len(w2id)).astype(np.int32)
+                self._ndocs += len(chunk)
+            df += self._df
+            # a bucket removed by the filters is enabled again when the documents of
+            # this call raise its frequency over the filters
+            w2id.mask |= (df > self._df) & self.filter(df, token_min_filter, token_max_filter)
+        else:
+            counter = Counter()
+            for tokens in docs:
+                # the new tokens get their identifiers in order of appearance
+                counter.update(dict.fromkeys(tokens, 1))
+                self._ndocs += 1
+            tokens = list(counter.keys())
+            freq = np.fromiter(counter.values(), dtype=np.int32, count=len(tokens))
+            mask = (w2id.lookup(tokens) >= 0) | self.filter(freq, token_min_filter, token_max_filter)
+            tokens = [t for t, m in zip(tokens, mask) if m]
+            w2id.extend(tokens)
+            df = np.zeros(len(w2id), dtype=np.int32)
+            df[w2id.lookup(tokens)] = freq[mask]
+            df[:self._df.shape[0]] += self._df
+        self._df = df
+        self._num_terms = len(w2id)
+        self._weight = None
+
+    def score(self):
+        """Score of the terms used to select them when the number of terms is capped, the document frequency
+
+        :rtype: np.array
+        """
+
+        return self._df
+
+    def filter(self, weight, token_min_filter=0, token_max_filter=1):
+        """Tokens kept by the filters on the number of documents containing the token
+
+        :param weight: number of documents containing each token
+        :type weight: np.array
+        :param token_min_filter: Keep those tokens that appear more times than the parameter
+        :type token_min_filter: int or float
+        :param token_max_filter: Keep those tokens that appear less times than the parameter
+        :type token_max_filter: int or float
+        :rtype: np.array
+        """
+
+        mask = np.ones(weight.shape[0], dtype=bool)
+        token_min_filter = self.min_frequency(token_min_filter, token_max_filter)
+        if token_min_filter > 0:
+            mask &= weight > token_min_filter
+        if token_max_filter != 1:
+            if token_max_filter < 1:
+                token_max_filter = int(self._ndocs * token_max_filter)
+            mask &= weight < token_max_filter
+        return mask
+
+    def min_frequency(self, token_min_filter=0, token_max_filter=1):
+        """Number of documents a token must exceed to be kept by :py:func:`TFIDF.filter`, 0 keeps all
+
+        :param token_min_filter: Keep those tokens that appear more times than the parameter
+        :type token_min_filter: int or float
+        :param token_max_filter: Keep those tokens that appear less times than the parameter
+        :type token_max_filter: int or float
+        :rtype: int
+        """
 
-    def __init__(self, docs, X=None, token_min_filter=0, token_max_filter=1):
-        w2id = {}
-        weight = {}
-        self._ndocs = len(docs)
-        for tokens in docs:
-            for x, freq in Counter(tokens).items():
-                try:
-                    ident = w2id[x]
-                    weight[ident] = weight[ident] + 1
-                except KeyError:
-                    ident = len(w2id)
-                    w2id[x] = ident
-                    weight[ident] = 1
         if token_min_filter > 0 or token_max_filter != 1:
             if token_min_filter < 1:
                 token_min_filter = int(self._ndocs * token_min_filter)
                 if token_min_filter < 1:
                     token_min_filter = 1
-            if token_min_filter > 0:
-                w2id = [(k, v) for k, v in w2id.items() if weight[v] > token_min_filter]
-            if token_max_filter != 1:
-                if token_max_filter < 1:
-                    token_max_filter = int(self._ndocs * token_max_filter)
-                w2id = [(k, v) for k, v in w2id if weight[v] < token_max_filter]
-            w2id.sort(key=lambda x: x[1])
-            mm = {k: v[1] for k, v in enumerate(w2id)}
-            w2id = {v[0]: k for k, v in enumerate(w2id)}
-            weight = {ident: weight[mm[ident]] for ident in w2id.values()}
-        self.word2id = w2id
-        self.wordWeight = weight
+            return token_min_filter
+        return 0
+
+    def __setstate__(self, state):
+        # models pickled with the vocabulary and the weights as dictionaries
+        self.__dict__.update(state)
+        if isinstance(self._w2id, dict):
+            self._w2id = Vocabulary(self._w2id)
+        if isinstance(self._weight, dict):
+            self._weight = np.array([self._weight[i] for i in range(len(self._weight))], dtype=np.float32)
 
     @property
     def num_terms(self):
@@ -85,24 +761,28 @@ class TFIDF(object):
 
     @word2id.setter
     def word2id(self, value):
+        if isinstance(value, dict):
+            value = Vocabulary(value)
         self._num_terms = len(value)
         self._w2id = value
 
     @property
     def wordWeight(self):
         """Weight associated to each word, this could be the inverse document frequency"""
+        if self._weight is None:
+            self.wordWeight = self._df
         return self._weight
 
     @wordWeight.setter
     def wordWeight(self, value):
         """Inverse document frequency
 
-        :param value: weights
-        :type value: dict
+        :param value: number of documents containing each word
+        :type value: np.array
         """
 
-        N = self._ndocs
-        self._weight = {k: np.log2(N / v) for k, v in value.items()}
+        with np.errstate(divide='ignore'):
+            self._weight = np.log2(self._ndocs / np.asarray(value, dtype=np.float64)).astype(np.float32)
 
     def doc2weight(self, tokens):
         """Weight associated to each token
@@ -112,22 +792,193 @@ class TFIDF(object):
 
         :rtype: tuple - ids, term frequency, wordWeight
         """
-        lst = []
-        w2id = self._w2id
-        weight = self.wordWeight
-        for token in tokens:
-            try:
-                id = w2id[token]
-                lst.append(id)
-            except KeyError:
-                continue
-        ids_tf = [(a, b) for a, b in Counter(lst).items()]
-        # ids, tf = np.unique(lst, return_counts=True)
-        ids = [x[0] for x in ids_tf]
-        tf = np.array([x[1] for x in ids_tf])
-        tf = tf / tf.sum()
-        df = np.array([weight[x] for x in ids])
-        return ids, tf, df
+        rows, ids, tf, df = self.doc2weight_batch([tokens])
+        return ids.tolist(), tf, df
+
+    def doc2weight_batch(self, docs):
+        """Weight associated to each token of a list of documents; it is the batch version
+        of :py:func:`TFIDF.doc2weight` where the terms are counted at once
+
+        :param docs: list of list of tokens
+        :type docs: list
+
+        :rtype: tuple - rows, ids, term frequency, wordWeight (as np.array)
+        """
+
+        if not isinstance(self._w2id, HashingVocabulary):
+            return self.counts2weight(self.counts(docs))
+        tokens, rows = flatten(docs)
+        ids, sign = self._w2id.lookup(tokens, sign=True)
+        mask = ids >= 0
+        nterms = max(self.num_terms, 1)
+        # signed hashing, the frequency is the sum of the signs
+        key, index = np.unique(rows[mask] * nterms + ids[mask], return_inverse=True)
+        tf = np.bincount(index, weights=sign[mask], minlength=key.shape[0])
+        total = np.bincount(rows[mask], minlength=len(docs))
+        rows, ids = np.divmod(key, nterms)
+        tf = tf / total[rows]
+        return rows, ids, tf, self.wordWeight[ids]
+
+    def counts(self, docs):
+        """Document-term count matrix of a list of documents, the columns are the terms of
+        the model and the unknown tokens are ignored; the vectors are computed on it
+        (see :py:func:`TFIDF.transform_counts`)
+
+        :param docs: list of list of tokens
+        :type docs: list
+
+        :rtype: csr_matrix
+
+        >>> from microtc.weighting import TFIDF
+        >>> tfidf = TFIDF([['buenos', 'dia'], ['dia']])
+        >>> tfidf.counts([['dia', 'X', 'dia', 'buenos']]).toarray()
+        array([[1, 2]], dtype=int32)
+        """
+
+        if isinstance(self._w2id, HashingVocabulary):
+            raise RuntimeError("The count matrix is not defined on signed feature hashing")
+        tokens, rows = flatten(docs)
+        ids = self._w2id.lookup(tokens)
+        mask = ids >= 0
+        counts = csr_matrix((np.ones(int(mask.sum()), dtype=np.int32), (rows[mask], ids[mask])),
+                            shape=(len(docs), self.num_terms))
+        counts.sum_duplicates()
+        return counts
+
+    @classmethod
+    def from_counts(cls, counts, tokens, order, X=None, token_min_filter=0, token_max_filter=1):
+        """Model trained on a document-term count matrix instead of the tokenized corpus;
+        it is the model obtained with the tokens of the documents (see :py:class:`microtc.counts.CountMatrix`)
+
+        :param counts: Number of times each token (column) appears in each document (row)
+        :type counts: csr_matrix
+        :param tokens: Token of each column, or the vocabulary mapping each token to its column
+        :type tokens: list or Vocabulary
+        :param order: Columns in use in the order the tokens appear in the corpus
+        :type order: np.array
+        :param X: original corpus, useful to pass extra information in a dict
+        :type X: list
+        :param token_min_filter: Keep those tokens that appear more times than the parameter
+        :type token_min_filter: int or float
+        :param token_max_filter: Keep those tokens that appear less times than the parameter
+        :type token_max_filter: int or float
+        :rtype: tuple - model and the columns of its terms
+
+        >>> from microtc.weighting import TFIDF
+        >>> from scipy.sparse import csr_matrix
+        >>> import numpy as np
+        >>> counts = csr_matrix(np.array([[0, 2, 1], [1, 0, 1]]))
+        >>> model, columns = TFIDF.from_counts(counts, ['a', 'b', 'c'], np.array([1, 2, 0]))
+        >>> columns, model.word2id['c']
+        (array([1, 2, 0]), 1)
+        >>> (model.transform_counts(counts[:, columns]) != model.transform([['b', 'b', 'c'], ['a', 'c']])).nnz
+        0
+        """
+
+        model = cls.__new__(cls)
+        model._ndocs = counts.shape[0]
+        # the matrix does not have explicit zeros
+        df = np.bincount(counts.indices, minlength=counts.shape[1])
+        mask = model.filter(df, token_min_filter, token_max_filter)
+        columns = order[mask[order]]
+        if isinstance(tokens, Vocabulary):
+            model.word2id = tokens.take(columns)
+        else:
+            model.word2id = {tokens[c]: i for i, c in enumerate(columns.tolist())}
+        model._df = df[columns].astype(np.int32)
+        model._weight = None
+        model._fit_counts(counts[:, columns], X)
+        return model, columns
+
+    def _fit_counts(self, counts, X):
+        # the weights are computed from the document frequencies when they are used
+        pass
+
+    def counts2weight(self, counts):
+        """Weight associated to each token of the documents of a count matrix whose columns
+        are the terms of the model; it is :py:func:`TFIDF.doc2weight_batch` on the counts
+
+        :param counts: Number of times each term (column) appears in each document (row)
+        :type counts: csr_matrix
+
+        :rtype: tuple - rows, ids, term frequency, wordWeight (as np.array)
+        """
+
+        counts = csr_matrix(counts)
+        counts.sum_duplicates()
+        ndocs = counts.shape[0]
+        rows = np.repeat(np.arange(ndocs), np.diff(counts.indptr))
+        ids = counts.indices.astype(np.int64)
+        tf = counts.data.astype(np.float64)
+        total = np.bincount(rows, weights=tf, minlength=ndocs)
+        tf = tf / total[rows]
+        return rows, ids, tf, self.wordWeight[ids]
+
+    def tocsr(self, rows, ids, values, ndocs):
+        """Sparse matrix with one row per document, non-finite values are removed
+
+        :param rows: row of each value
+        :type rows: np.array
+        :param ids: column (token identifier) of each value
+        :type ids: np.array
+        :param values: values
+        :type values: np.array
+        :param ndocs: number of documents (rows)
+        :type ndocs: int
+        :rtype: csr_matrix
+        """
+
+        mask = np.isfinite(values)
+        rows, ids, values = rows[mask], ids[mask], values[mask]
+        indptr = np.zeros(ndocs + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=ndocs), out=indptr[1:])
+        return csr_matrix((values, ids, indptr), shape=(ndocs, self.num_terms))
+
+    def transform(self, docs):
+        """
+        Vectors of a list of documents, e.g., TF-IDF normalised; they are computed on the
+        count matrix of the documents (see :py:func:`TFIDF.counts`) except on feature hashing.
+
+        :param docs: list of list of tokens
+        :type docs: list
+
+        :rtype: csr_matrix
+
+        >>> from microtc.weighting import TFIDF
+        >>> tokens = [['buenos', 'dia', 'microtc'], ['excelente', 'dia'], ['buenas', 'tardes']]
+        >>> tfidf = TFIDF(tokens)
+        >>> tfidf.transform([['buenos', 'X', 'dia'], ['tardes']]).shape
+        (2, 6)
+        """
+
+        if isinstance(self._w2id, HashingVocabulary):
+            return self.vectors(*self.doc2weight_batch(docs), len(docs))
+        return self.transform_counts(self.counts(docs))
+
+    def transform_counts(self, counts):
+        """
+        Vectors of the documents of a count matrix whose columns are the terms of the model
+        (see :py:func:`TFIDF.from_counts`); the weighting scheme scales the columns of the
+        term frequencies by wordWeight and then normalises the rows (see :py:func:`TFIDF.vectors`)
+
+        :param counts: Number of times each term (column) appears in each document (row)
+        :type counts: csr_matrix
+
+        :rtype: csr_matrix
+        """
+
+        return self.vectors(*self.counts2weight(counts), counts.shape[0])
+
+    def vectors(self, rows, ids, tf, df, ndocs):
+        """
+        TF-IDF vectors, normalised, from the output of :py:func:`TFIDF.doc2weight_batch`
+
+        :rtype: csr_matrix
+        """
+
+        w = tf * df
+        norm = np.sqrt(np.bincount(rows, weights=w * w, minlength=ndocs))
+        return self.tocsr(rows, ids, w / norm[rows], ndocs)
 
     def __getitem__(self, tokens):
         """
@@ -149,17 +1000,19 @@ class TF(TFIDF):
     @property
     def wordWeight(self):
         """Weight associated to each word, this is one on TF"""
+        if self._weight is None:
+            self.wordWeight = self._df
         return self._weight
 
     @wordWeight.setter
     def wordWeight(self, value):
         """Inverse document frequency
 
-        :param value: weights
-        :type value: dict
+        :param value: number of documents containing each word
+        :type value: np.array
         """
 
-        self._weight = {k: 1 for k, v in value.items()}
+        self._weight = np.ones(len(value), dtype=np.float32)
 
     def __getitem__(self, tokens):
         """
@@ -175,6 +1028,15 @@ class TF(TFIDF):
         r = [(i, _tf) for i, _tf, _df in zip(*__)]
         return r
 
+    def vectors(self, rows, ids, tf, df, ndocs):
+        """
+        TF vectors from the output of :py:func:`TFIDF.doc2weight_batch`
+
+        :rtype: csr_matrix
+        """
+
+        return self.tocsr(rows, ids, tf, ndocs)
+
 
 class Entropy(TFIDF):
     """
@@ -188,14 +1050,81 @@ class Entropy(TFIDF):
     >>> ent = Entropy(tokens, X=[dict(text=t, klass=k) for t, k in zip(tokens, y)])
     >>> vector = ent['buenos', 'X', 'dia']
     """
+    # the corpus is traversed twice, once more for the frequencies per class
+    two_passes = True
+
     def __init__(self, docs, X=None, **kwargs):
         assert X is not None
+        if iter(docs) is docs:
+            raise ValueError("Entropy traverses the corpus twice, docs cannot be an iterator")
         super(Entropy, self).__init__(docs, X=X, **kwargs)
-        self.wordWeight = self.entropy(docs, X, self.word2id)
+        if getattr(self, '_klass_df', None) is None:
+            self._klasses, self._klass_df = self.klass_frequency(docs, X, self.word2id)
+        self.wordWeight = self.entropy_weight(self._klass_df)
+
+    def select(self, docs, X, max_terms):
+        """Keeps the `max_terms` tokens with the highest score, i.e., the entropy weight
+        times the logarithm of the document frequency
+
+        :param docs: corpus as a list of list of tokens
+        :type docs: iterable
+        :param X: original corpus
+        :type X: iterable
+        :param max_terms: Number of tokens
+        :type max_terms: int
+        """
+
+        self._klasses, self._klass_df = self.klass_frequency(docs, X, self.word2id)
+        self.keep(self.top(self.score(), max_terms))
+
+    def partial_fit(self, docs, X=None):
+        """Updates the model with more documents (see :py:func:`TFIDF.partial_fit`),
+        the number of documents per class is also updated
+
+        :param docs: corpus as a list of list of tokens
+        :type docs: iterable
+        :param X: original corpus, the key klass contains the label
+        :type X: iterable
+        :rtype: self
+        """
+
+        assert X is not None
+        if iter(docs) is docs:
+            raise ValueError("Entropy traverses the corpus twice, docs cannot be an iterator")
+        if getattr(self, '_klass_df', None) is None:
+            raise RuntimeError("The model does not keep the document frequencies, it must be trained again")
+        return super(Entropy, self).partial_fit(docs, X=X)
+
+    def _update(self, docs, X):
+        super(Entropy, self)._update(docs, X)
+        weight = np.zeros((self._klass_df.shape[0], self.num_terms), dtype=np.int32)
+        weight[:, :self._klass_df.shape[1]] = self._klass_df
+        self._klasses, self._klass_df = self.klass_frequency(docs, X, self.word2id,
+                                                             klasses=self._klasses, weight=weight)
+
+    def score(self):
+        """Score of the terms used to select them when the number of terms is capped,
+        the entropy weight times the logarithm of the document frequency
+
+        :rtype: np.array
+        """
+
+        return self.entropy_weight(self._klass_df) * np.log2(1 + self._df)
+
+    def keep(self, ids):
+        super(Entropy, self).keep(ids)
+        if getattr(self, '_klass_df', None) is None:
+            return
+        if isinstance(self._w2id, HashingVocabulary):
+            self._klass_df[:, ~self._w2id.mask] = 0
+        else:
+            self._klass_df = self._klass_df[:, ids]
 
     @property
     def wordWeight(self):
         """Weight associated to each word, entropy per token"""
+        if self._weight is None:
+            self.wordWeight = self.entropy_weight(self._klass_df)
         return self._weight
 
     @wordWeight.setter
@@ -203,43 +1132,62 @@ class Entropy(TFIDF):
         """Entropy
 
         :param value: weights
-        :type value: dict
+        :type value: np.array
         """
 
-        if isinstance(value, dict):
-            self._weight = value
-        else:
-            self._weight = {k: v for k, v in enumerate(value)}
+        self._weight = np.asarray(value, dtype=np.float32)
 
     @staticmethod
-    def entropy(corpus, docs, word2id):
+    def klass_frequency(corpus, docs, word2id, klasses=None, weight=None):
         """
-        Compute entropy
+        Number of documents of each class containing each token
 
         :param corpus: Tokenized corpus, i.e., as a list of tokens list
-        :type corpus: list
+        :type corpus: iterable
         :param docs: Original corpus is a list of dictionaries where key klass contains the class or label
-        :type docs: list
+        :type docs: iterable
         :param word2id: Map token to identifier
-        :type word2id: dict
+        :type word2id: dict or Vocabulary
+        :param klasses: Map label to row, it is updated with the new labels
+        :type klasses: dict
+        :param weight: Frequencies to be updated
+        :type weight: np.array
 
-        :rtype: np.array
+        :rtype: tuple - labels and frequencies
         """
         m = word2id
-        y = [x[KLASS] for x in docs]
-        klasses = np.unique(y)
-        nklasses = klasses.shape[0]
+        if isinstance(m, dict):
+            m = Vocabulary(m)
         ntokens = len(m)
-        weight = np.zeros((klasses.shape[0], ntokens))
-        for ki, klass in enumerate(klasses):
-            for _y, tokens in zip(y, corpus):
-                if _y != klass:
-                    continue
-                for x in Counter(tokens).keys():
-                    try:
-                        weight[ki, m[x]] += 1
-                    except KeyError:
-                        continue
+        if klasses is None:
+            klasses = dict()
+            weight = np.zeros((0, ntokens), dtype=np.int32)
+        for chunk in chunks(zip(corpus, docs)):
+            y = []
+            for _, x in chunk:
+                k = klasses.setdefault(x[KLASS], len(klasses))
+                if k == weight.shape[0]:
+                    weight = np.vstack([weight, np.zeros((1, ntokens), dtype=np.int32)])
+                y.append(k)
+            tokens, rows = flatten([tokens for tokens, _ in chunk])
+            ids = m.lookup(tokens)
+            mask = ids >= 0
+            key = np.unique(rows[mask] * ntokens + ids[mask])
+            rows, ids = np.divmod(key, ntokens)
+            np.add.at(weight, (np.array(y)[rows], ids), 1)
+        return klasses, weight
+
+    @staticmethod
+    def entropy_weight(weight):
+        """
+        1 - entropy of each token given the number of documents of each class containing it
+
+        :param weight: Frequencies, as many rows as classes
+        :type weight: np.array
+        :rtype: np.array
+        """
+
+        nklasses = weight.shape[0]
         weight = weight / weight.sum(axis=0)
         weight[~np.isfinite(weight)] = 1.0 / nklasses
         logc = np.log2(weight)
@@ -248,6 +1196,24 @@ class Entropy(TFIDF):
             logc = logc / np.log2(nklasses)
         return (1 + (weight * logc).sum(axis=0))
 
+    @staticmethod
+    def entropy(corpus, docs, word2id):
+        """
+        Compute entropy
+
+        :param corpus: Tokenized corpus, i.e., as a list of tokens list
+        :type corpus: iterable
+        :param docs: Original corpus is a list of dictionaries where key klass contains the class or label
+        :type docs: iterable
+        :param word2id: Map token to identifier
+        :type word2id: dict or Vocabulary
+
+        :rtype: np.array
+        """
+
+        _, weight = Entropy.klass_frequency(corpus, docs, word2id)
+        return Entropy.entropy_weight(weight)
+
     def __getitem__(self, tokens):
         """
         Entropy
@@ -259,5 +1225,22 @@ class Entropy(TFIDF):
         """
 
         __ = self.doc2weight(tokens)
-        r = [(i, _df) for i, _tf, _df in zip(*__)]
+        r = [(i, np.sign(_tf) * _df) for i, _tf, _df in zip(*__)]
         return r
+
+    def vectors(self, rows, ids, tf, df, ndocs):
+        """
+        Entropy vectors from the output of :py:func:`TFIDF.doc2weight_batch`
+
+        :rtype: csr_matrix
+        """
+
+        return self.tocsr(rows, ids, np.sign(tf) * df, ndocs)
+
+    def _fit_counts(self, counts, X):
+        klasses = dict()
+        y = np.array([klasses.setdefault(x[KLASS], len(klasses)) for x in X], dtype=np.int64)
+        rows = np.repeat(np.arange(counts.shape[0]), np.diff(counts.indptr))
+        nterms = counts.shape[1]
+        weight = np.bincount(y[rows] * nterms + counts.indices, minlength=len(klasses) * nterms)
+        self._klasses, self._klass_df = klasses, weight.reshape(len(klasses), nterms).astype(np.int32)
@@ -32,8 +32,12 @@ setup(
         "Operating System :: MacOS :: MacOS X",
         "Operating System :: POSIX :: Linux",
         'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
         "Topic :: Scientific/Engineering :: Artificial Intelligence"],
 
+    # pickle protocol 5 (models), ThreadingHTTPServer, and the order of the dictionaries
+    python_requires='>=3.8',
     packages=['microtc', 'microtc/tests', 'microtc/tools'],
     include_package_data=True,
     zip_safe=False,
@@ -49,6 +53,7 @@ setup(
         'microtc/tools/microtc-textModel',
         'microtc/tools/microtc-perf',
         'microtc/tools/microtc-ensemble',
-        'microtc/tools/microtc-kfolds'
+        'microtc/tools/microtc-kfolds',
+        'microtc/tools/microtc-serve'
     ]
 )